@@ -1,17 +1,34 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context, abort, g
+from werkzeug.wsgi import wrap_file
 from flask_cors import CORS
 import os
-import requests
-import uuid
-import tempfile
-import io
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Image as RLImage
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from PIL import Image
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from image_selector import ImageSelector
+from image_cache import ImageCache, StorageQuotaExceeded
+from image_download import ImageDownloader, ImageDownloadError
+from image_storage import StorageSweeper, create_image_references, image_hash, story_image_keys
+from static_assets import StaticAssets
+from image_derivatives import DerivativeGenerator
+from image_fetcher import ImageFetcher, CircuitOpenError
+from pdf_assets import PdfImageLoader
+from pdf_themes import THEMES, get_theme
+from pdf_render import render_story_pdf
+from pdf_jobs import PdfJobQueue, PdfQueueFull
+from story_store import create_story_store
+from story_cache import StoryResponseCache, story_request_key
+from story_templates import StoryTemplateEngine
+from text_rewriter import TextRewriter
+from intent_index import IntentIndex
+from story_batch import parse_story_requests, generate_story_batch
+import metrics
 
-app = Flask(__name__, static_folder='static', static_url_path='/static')
+# /static is served by serve_static below, not Flask's built-in handler
+app = Flask(__name__, static_folder=None)
 CORS(app)
 
 # Create necessary directories if they don't exist
@@ -20,125 +37,447 @@ if not os.path.exists('temp_images'):
 if not os.path.exists('static'):
     os.makedirs('static')
 
+# Set by gunicorn.conf.py: the app is imported and warmed once, then forked into
+# workers, so no background thread may start until start_background_work() runs
+PRELOAD_FOR_FORK = os.environ.get('STORYTELLER_PRELOAD') == '1'
+
+# Scene images are fetched in parallel; both limits can be tuned from the environment
+IMAGE_FETCH_WORKERS = int(os.environ.get('IMAGE_FETCH_WORKERS', '8'))
+STORY_IMAGE_DEADLINE = float(os.environ.get('STORY_IMAGE_DEADLINE', '20'))
+
+image_fetch_pool = ThreadPoolExecutor(max_workers=IMAGE_FETCH_WORKERS, thread_name_prefix='image-fetch')
+
+# Smaller JPEG/WebP copies of every stored image for responsive srcsets
+image_derivatives = DerivativeGenerator(
+    'static',
+    url_prefix='/static',
+    widths=[int(w) for w in os.environ.get('IMAGE_DERIVATIVE_WIDTHS', '320,640,1024').split(',')],
+    formats=os.environ.get('IMAGE_DERIVATIVE_FORMATS', 'jpg,webp').split(','),
+    workers=int(os.environ.get('IMAGE_DERIVATIVE_WORKERS', '2'))
+)
+
+# Downloaded images are deduplicated on disk and evicted once the budget is exceeded
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Hard limit on bytes under static/ (originals plus derivatives); writes that can't fit are refused
+IMAGE_STORAGE_QUOTA_BYTES = int(os.environ.get('IMAGE_STORAGE_QUOTA_BYTES', str(1024 * 1024 * 1024)))
+# Unreferenced images untouched for this long are deleted by the storage sweeper
+IMAGE_ORPHAN_TTL = int(os.environ.get('IMAGE_ORPHAN_TTL', str(7 * 24 * 3600)))
+STORAGE_SWEEP_INTERVAL = int(os.environ.get('STORAGE_SWEEP_INTERVAL', '3600'))
+
+# Which stored images shared stories still point at; kept alongside the story store
+image_references = create_image_references(
+    backend=os.environ.get('STORY_STORE', 'sqlite'),
+    path=os.environ.get('STORY_STORE_PATH', 'shared_stories.db')
+)
+
+# Response metadata for everything under /static, so serving a file needs no stat
+static_assets = StaticAssets('static')
+
+def on_image_evicted(content_hash):
+    image_derivatives.remove(content_hash)
+    static_assets.forget_hash(content_hash)
+
+image_cache = ImageCache(
+    'static',
+    url_prefix='/static',
+    max_bytes=IMAGE_CACHE_MAX_BYTES,
+    on_store=image_derivatives.schedule,
+    on_evict=on_image_evicted,
+    quota_bytes=IMAGE_STORAGE_QUOTA_BYTES or None,
+    pinned=image_references.referenced_hashes,
+    rescan_interval=STORAGE_SWEEP_INTERVAL
+)
+image_derivatives.store = image_cache.put_derivative
+if PRELOAD_FOR_FORK:
+    image_derivatives.pause()
+image_derivatives.scan()
+
+# Every outbound image download goes through one pooled session with timeouts and retries
+image_fetcher = ImageFetcher(
+    pool_size=IMAGE_FETCH_WORKERS,
+    connect_timeout=float(os.environ.get('IMAGE_FETCH_CONNECT_TIMEOUT', '3.05')),
+    read_timeout=float(os.environ.get('IMAGE_FETCH_READ_TIMEOUT', '10')),
+    retries=int(os.environ.get('IMAGE_FETCH_RETRIES', '2'))
+)
+
+# Downloads stream to disk in chunks; oversized or non-image responses are refused
+image_downloader = ImageDownloader(
+    image_cache,
+    max_bytes=int(os.environ.get('IMAGE_DOWNLOAD_MAX_BYTES', str(20 * 1024 * 1024))),
+    chunk_size=int(os.environ.get('IMAGE_DOWNLOAD_CHUNK_BYTES', str(64 * 1024))),
+    # Optionally downscale stored originals to this many pixels on the longest side (0 keeps them)
+    max_dimension=int(os.environ.get('IMAGE_MAX_DIMENSION', '0')) or None
+)
+
+# Decoded, PDF-ready images are kept between exports
+pdf_image_loader = PdfImageLoader(image_fetcher, image_downloader, static_dir='static', static_prefix='/static/')
+
+# Background PDF rendering; finished files are cached by story hash and kept for PDF_EXPORT_TTL seconds
+pdf_jobs = PdfJobQueue(
+    pdf_image_loader,
+    output_dir='pdf_exports',
+    workers=int(os.environ.get('PDF_EXPORT_WORKERS', '2')),
+    max_pending=int(os.environ.get('PDF_EXPORT_MAX_PENDING', '64')),
+    ttl=int(os.environ.get('PDF_EXPORT_TTL', str(24 * 3600)))
+)
+
+# Resolved answers kept for /api/ask (one per intent, plus recent fallback questions)
+ANSWER_CACHE_SIZE = int(os.environ.get('ANSWER_CACHE_SIZE', '1024'))
+
 class StoryGenerator:
     def __init__(self):
         """Initialize story generator in demo mode"""
         self.image_selector = ImageSelector()
+        self.story_templates = StoryTemplateEngine()
+        self.text_rewriter = TextRewriter.from_file()
+        self.intents = IntentIndex()
+        # Resolved /api/ask answers: intent id (or exact question) -> (answer, image_url, source_url)
+        self._answers = OrderedDict()
+        self._answers_lock = threading.Lock()
+        self.image_cache = image_cache
+        self.image_fetcher = image_fetcher
+        self.image_downloader = image_downloader
         print("Running in demo mode - using pre-generated stories and images")
     
     def generate_story(self, idea, genre="fantasy", tone="adventurous", audience="general", art_style="realistic"):
         """Generate a demo story (no API required)"""
-        # Create a demo story based on the user's idea
-        demo_story = {
-            "title": f"The Tale of {idea}",
-            "genre": genre,
-            "theme": f"An {tone} story about {idea}",
-            "scenes": [
-                {
-                    "scene_number": 1,
-                    "title": "The Beginning",
-                    "text": f"In a {genre} world, our story begins with {idea}. The atmosphere was filled with {tone} energy as the adventure was about to unfold. The {audience} audience would soon discover an incredible tale.",
-                    "image_prompt": f"A {art_style} scene showing {idea} in a {genre} setting"
-                },
-                {
-                    "scene_number": 2,
-                    "title": "The Discovery",
-                    "text": f"As the story progressed, new elements of {idea} came to light. Each moment brought fresh surprises and unexpected turns. The {tone} nature of the tale kept everyone engaged.",
-                    "image_prompt": f"A {art_style} illustration of the discovery moment related to {idea}"
-                },
-                {
-                    "scene_number": 3,
-                    "title": "The Challenge",
-                    "text": f"Suddenly, a great challenge appeared. The world of {idea} faced its greatest test yet. The {tone} atmosphere intensified as the stakes grew higher.",
-                    "image_prompt": f"A dramatic {art_style} scene showing the challenge in {idea}"
-                },
-                {
-                    "scene_number": 4,
-                    "title": "The Climax",
-                    "text": f"Everything came to a head in an explosive moment. The true nature of {idea} was revealed. The {audience} watched in amazement as events unfolded.",
-                    "image_prompt": f"An intense {art_style} illustration of the climactic moment in {idea}"
-                },
-                {
-                    "scene_number": 5,
-                    "title": "The Resolution",
-                    "text": f"Finally, everything came together. The story of {idea} reached its natural conclusion. The {tone} journey had transformed everyone involved.",
-                    "image_prompt": f"A satisfying {art_style} conclusion scene for {idea}"
-                }
-            ]
-        }
-        return demo_story
-        
-        # Since we're running in demo mode, we'll return the demo story
-        return demo_story
+        # Scenes come from the template picked for this genre, tone and audience
+        with metrics.span('story_construction'):
+            return self.story_templates.render(idea, genre, tone, audience, art_style)
+    
+    def story_outline(self, idea, genre="fantasy", tone="adventurous", audience="general", art_style="realistic"):
+        """Return the story header (with its scene count) and a generator of its scenes"""
+        template = self.story_templates.select(genre, tone, audience)
+        story = template.header(idea, genre, tone, audience, art_style)
+        story['scene_count'] = template.scene_count
+        return story, template.iter_scenes(idea, genre, tone, audience, art_style)
     
     def generate_demo_story(self, idea, genre="fantasy", tone="adventurous", audience="general", art_style="realistic"):
         """Generate a fallback demo story"""
-        return {
-            "title": f"A Simple Tale of {idea}",
-            "genre": genre,
-            "theme": f"A {tone} story",
-            "scenes": [
-                {
-                    "scene_number": 1,
-                    "title": "Once Upon a Time",
-                    "text": f"In a world of {genre}, there was {idea}. The story begins to unfold.",
-                    "image_prompt": f"A simple {art_style} scene of {idea}"
-                },
-                {
-                    "scene_number": 2,
-                    "title": "And Then...",
-                    "text": f"Something interesting happened with {idea}, leading to new discoveries.",
-                    "image_prompt": f"A {art_style} illustration of {idea} in action"
-                },
-                {
-                    "scene_number": 3,
-                    "title": "The Plot Thickens",
-                    "text": f"The situation with {idea} became more complex and intriguing.",
-                    "image_prompt": f"A detailed {art_style} scene focused on {idea}"
-                }
-            ]
-        }
+        return self.story_templates.render(idea, genre, tone, audience, art_style, template='simple')
     
-    def generate_image(self, prompt, art_style="realistic"):
+    def generate_image(self, prompt, art_style="realistic", source_url=None):
         """Generate an image using demo images from Unsplash"""
         try:
-            # Use the image selector to get a relevant demo image
-            image_url = self.image_selector.get_scene_specific_image(prompt, "fantasy", "default")
+            # Use the image selector to get a relevant demo image, unless one was picked already
+            image_url = source_url
+            if not image_url:
+                with metrics.span('image_selection'):
+                    image_url = self.image_selector.get_scene_specific_image(prompt, "fantasy", "default", key=prompt)
+            
+            # Serve repeat images from the local cache without a network hit
+            cached_url = self.image_cache.get(image_url)
+            if cached_url:
+                return cached_url
             
             # Download and save the image locally for better performance
             try:
-                img_response = requests.get(image_url)
-                if img_response.status_code == 200:
-                    # Create unique filename
-                    unique_id = str(uuid.uuid4())
-                    temp_path = os.path.join('static', f"{unique_id}.jpg")
-                    
-                    # Save the image
-                    with open(temp_path, "wb") as f:
-                        f.write(img_response.content)
-                    
-                    # Return local path
-                    return f"/static/{unique_id}.jpg"
-                else:
-                    print(f"Failed to download image: {img_response.status_code}")
-                    return image_url  # Fall back to direct URL if download fails
+                with metrics.span('image_download'):
+                    img_response = self.image_fetcher.get(image_url, stream=True)
+                    with img_response:
+                        if img_response.status_code == 200:
+                            # Streamed to disk and stored once per distinct image, named by content hash
+                            return self.image_downloader.store(image_url, img_response)
+                print(f"Failed to download image: {img_response.status_code}")
+                metrics.fallback('download_status')
+                return image_url  # Fall back to direct URL if download fails
+            except CircuitOpenError as e:
+                print(f"Skipping download: {e}")
+                metrics.fallback('circuit_open')
+                return self.image_selector.get_demo_image()  # Upstream unhealthy, don't wait on it
+            except StorageQuotaExceeded as e:
+                print(f"Not storing image locally: {e}")
+                metrics.fallback('storage_quota')
+                return image_url  # Disk full of pinned images, link the source directly
+            except ImageDownloadError as e:
+                print(f"Rejected downloaded image: {e}")
+                metrics.fallback('invalid_image')
+                return self.image_selector.get_demo_image()  # Don't link something that isn't an image
             except Exception as e:
                 print(f"Error saving image locally: {e}")
+                metrics.fallback('download_error')
                 return image_url  # Fall back to direct URL if save fails
             
         except Exception as e:
             print(f"Error generating image: {e}")
+            metrics.fallback('demo_image')
             # Return demo image when everything fails
             return self.get_demo_image(prompt, art_style)
     
+    def image_srcset(self, image_url):
+        """Return the responsive derivative URLs for a locally stored image"""
+        return image_derivatives.srcset(image_url)
+    
+    def attach_image(self, scene, image_url):
+        """Set a scene's image URL along with its srcset map"""
+        scene['image_url'] = image_url
+        scene['image_srcset'] = self.image_srcset(image_url)
+    
     def get_demo_image(self, prompt, art_style="realistic"):
         """Get a demo image based on the prompt"""
         # Use the scene-specific image selection for better relevance
-        return self.image_selector.get_scene_specific_image(prompt, "fantasy", "default")
+        return self.image_selector.get_scene_specific_image(prompt, "fantasy", "default", key=prompt)
+    
+    def enhance_text(self, scene_text):
+        """Enhance the text without API - add more descriptive elements"""
+        # Substitutions and sentence breaks from data/text_rewrites.json, applied in one pass
+        return self.text_rewriter.rewrite(scene_text)
+    
+    def enhance_texts(self, scene_texts):
+        """Enhance several scene texts in one call"""
+        return self.text_rewriter.rewrite_many(scene_texts)
+    
+    def match_question(self, question):
+        """Match a question to an intent and return (match, memo key, memoized (answer, image_url) or None)"""
+        match = self.intents.match(question)
+        # Intent answers are shared by every question that maps to them; fallbacks quote the question
+        key = match.intent_id if match.intent_id is not None else ('question', question)
+        with self._answers_lock:
+            entry = self._answers.get(key)
+            if entry is not None:
+                self._answers.move_to_end(key)
+        if entry is not None:
+            answer, image_url, source_url = entry
+            # A stored image may have been evicted from the cache since
+            if not image_url.startswith(self.image_cache.url_prefix + '/') or self.image_cache.get(source_url):
+                return match, key, (answer, image_url)
+        return match, key, None
+    
+    def question_image_source(self, match):
+        """Pick the source image for an answer's image prompt"""
+        return self.image_selector.get_scene_specific_image(match.image_prompt, "fantasy", "default", key=match.image_prompt)
+    
+    def remember_answer(self, key, answer, image_url, source_url):
+        with self._answers_lock:
+            self._answers[key] = (answer, image_url, source_url)
+            self._answers.move_to_end(key)
+            while len(self._answers) > ANSWER_CACHE_SIZE:
+                self._answers.popitem(last=False)
+    
+    def answer_question(self, question):
+        """Return (text_response, image_url) for a question, memoized per intent"""
+        match, key, cached = self.match_question(question)
+        if cached is not None:
+            return cached
+        
+        source_url = self.question_image_source(match)
+        image_url = self.generate_image(match.image_prompt, source_url=source_url)
+        self.remember_answer(key, match.answer, image_url, source_url)
+        return match.answer, image_url
+    
+    def generate_scene_image(self, scene, art_style="realistic", source_url=None):
+        """Generate the image for one scene, retrying once with a simplified prompt"""
+        try:
+            image_url = self.generate_image(scene['image_prompt'], art_style, source_url)
+            if not image_url:
+                raise ValueError("Failed to generate image")
+            return image_url
+        except Exception as img_error:
+            print(f"Error generating image for scene {scene.get('scene_number')}: {img_error}")
+            metrics.fallback('simplified_prompt')
+            # Try one more time with a simplified prompt
+            try:
+                simplified_prompt = f"Create a {art_style} style image of: {scene['title']}"
+                image_url = self.generate_image(simplified_prompt, art_style)
+                return image_url if image_url else None
+            except:
+                return None
+    
+    def iter_scene_images(self, scenes, art_style="realistic", deadline=None, genre=None):
+        """Fetch the images for all scenes concurrently, yielding each scene as soon as it is ready"""
+        if deadline is None:
+            deadline = STORY_IMAGE_DEADLINE
+        
+        # Scenes may arrive as a generator; image selection needs the whole story
+        scenes = list(scenes)
+        
+        # Pick the whole story's images in one pass so scenes don't repeat images
+        with metrics.span('image_selection'):
+            source_urls = self.image_selector.select_story_images([scene['image_prompt'] for scene in scenes], genre)
+        
+        futures = {}
+        for scene, source_url in zip(scenes, source_urls):
+            future = image_fetch_pool.submit(self.generate_scene_image, scene, art_style, source_url)
+            futures[future] = (scene, source_url)
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                pending.discard(future)
+                scene, _ = futures[future]
+                self.attach_image(scene, future.result())
+                yield scene
+        except FuturesTimeoutError:
+            pass
+        
+        for future in pending:
+            # Out of time - use the direct URL instead of waiting for the download
+            future.cancel()
+            scene, source_url = futures[future]
+            print(f"Image for scene {scene.get('scene_number')} missed the {deadline}s deadline")
+            metrics.fallback('deadline')
+            self.attach_image(scene, source_url)
+            yield scene
+    
+    def generate_scene_images(self, scenes, art_style="realistic", deadline=None, genre=None):
+        """Fetch the images for all scenes concurrently, keeping the scene order"""
+        for _ in self.iter_scene_images(scenes, art_style, deadline, genre):
+            pass
+        return scenes
     
 
 story_generator = StoryGenerator()
 
+# Shared stories persist in SQLite so every worker process sees them
+story_ttl = int(os.environ.get('STORY_TTL_SECONDS', str(30 * 24 * 3600)))
+shared_stories = create_story_store(
+    backend=os.environ.get('STORY_STORE', 'sqlite'),
+    path=os.environ.get('STORY_STORE_PATH', 'shared_stories.db'),
+    ttl=story_ttl or None,
+    cache_size=int(os.environ.get('STORY_CACHE_SIZE', '1024'))
+)
+
+def pin_shared_images(story_id, story_data, expires_at=None):
+    """Keep the images a shared story shows from being swept while the share is live"""
+    if expires_at is None and story_ttl:
+        expires_at = time.time() + story_ttl
+    image_references.add(f"share:{story_id}", story_image_keys(story_data), expires_at)
+
+if image_references.created:
+    # Stories shared before the registry existed still need their images
+    for shared_id, shared_data, shared_expires_at in shared_stories.iter_stories():
+        pin_shared_images(shared_id, shared_data, shared_expires_at)
+
+# Deletes unreferenced images, legacy files and stale temp files in the background
+storage_sweeper = StorageSweeper(image_cache, image_references, ttl=IMAGE_ORPHAN_TTL, interval=STORAGE_SWEEP_INTERVAL)
+
+def start_background_work():
+    """Start this process's background threads (in each forked worker under gunicorn.conf.py)"""
+    image_derivatives.resume()
+    storage_sweeper.start()
+
+if not PRELOAD_FOR_FORK:
+    start_background_work()
+
+# Finished /api/generate-story responses, keyed by the normalized request parameters
+story_response_cache = StoryResponseCache(
+    ttl=int(os.environ.get('STORY_RESPONSE_CACHE_TTL', '300')),
+    max_entries=int(os.environ.get('STORY_RESPONSE_CACHE_SIZE', '256'))
+)
+# Stories with a fallback image are only cached this long (0 = not at all), so they heal quickly
+STORY_RESPONSE_DEGRADED_TTL = int(os.environ.get('STORY_RESPONSE_DEGRADED_TTL', '10'))
+
+def story_is_degraded(story_data):
+    """True if any scene isn't showing a locally stored image with its derivatives.
+
+    That covers deadline, circuit-open and download fallbacks (a remote or
+    demo URL) as well as images whose derivatives weren't rendered yet.
+    """
+    return any(
+        image_hash(scene.get('image_url')) is None or not scene.get('image_srcset')
+        for scene in story_data['scenes']
+    )
+
+def story_response_ttl(story_data):
+    """Response cache lifetime for a built story: the default, or the short one if it is degraded"""
+    return STORY_RESPONSE_DEGRADED_TTL if story_is_degraded(story_data) else None
+
+# Counters the caches keep themselves, read when /api/metrics is scraped
+metrics.registry.callback(
+    'storyteller_image_cache_events_total', 'Image cache lookups and evictions',
+    metrics.stats_callback(
+        image_cache.stats, {'hit': 'hits', 'miss': 'misses', 'eviction': 'evictions', 'rejection': 'rejections'}
+    ),
+    ['event'], kind='counter'
+)
+metrics.registry.callback(
+    'storyteller_image_cache_bytes', 'Bytes held in the on-disk image cache', lambda: image_cache.stats()['bytes']
+)
+metrics.registry.callback(
+    'storyteller_story_cache_events_total', 'Story response cache lookups',
+    metrics.stats_callback(story_response_cache.stats, {'hit': 'hits', 'miss': 'misses', 'coalesced': 'coalesced'}),
+    ['event'], kind='counter'
+)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    labels = {'route': request.endpoint or 'unmatched', 'method': request.method, 'status': response.status_code}
+    
+    def record():
+        metrics.request_seconds.observe(time.perf_counter() - started, **labels)
+    
+    if response.is_streamed:
+        # The body hasn't been generated yet; stop the clock when the server closes it after the last chunk
+        response.call_on_close(record)
+    else:
+        record()
+    return response
+
+def build_story_pdf(story_data, theme=None):
+    """Render a story into an in-memory PDF"""
+    # Resolve every scene image up front, remote ones in parallel
+    with metrics.span('pdf_images'):
+        images = pdf_image_loader.load_many(scene.get('image_url') for scene in story_data['scenes'])
+    with metrics.span('pdf_build'):
+        return render_story_pdf(story_data, theme or get_theme(), images)
+
+# Pre-download the demo image collections during warm-up, for at most this many seconds
+WARM_IMAGE_CACHE = os.environ.get('WARM_IMAGE_CACHE', '1') != '0'
+WARM_UP_IMAGE_DEADLINE = float(os.environ.get('WARM_UP_IMAGE_DEADLINE', '30'))
+# The genre and tone choices offered by index.html
+WARM_UP_GENRES = ('fantasy', 'sci-fi', 'mystery', 'adventure')
+WARM_UP_TONES = ('adventurous', 'mysterious', 'humorous', 'dramatic')
+
+# Reported by /api/ready, which answers 503 until warm_up() has finished
+warm_up_state = {'ready': False, 'seconds': None, 'images': 0}
+
+def warm_image_cache(deadline):
+    """Store every demo image locally, so first stories are cache hits; return how many are stored"""
+    sources = story_generator.image_selector.all_images
+    stored = 0
+    # A short-lived pool: its threads are joined before the caller forks
+    with ThreadPoolExecutor(max_workers=IMAGE_FETCH_WORKERS, thread_name_prefix='warm-up') as pool:
+        futures = [pool.submit(story_generator.generate_image, '', source_url=url) for url in sources]
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                if future.result().startswith(image_cache.url_prefix + '/'):
+                    stored += 1
+        except FuturesTimeoutError:
+            print(f"Image cache warm-up stopped after {deadline}s")
+            for future in futures:
+                future.cancel()
+    return stored
+
+def warm_up():
+    """Do the work the first requests would otherwise pay for, then report ready.
+
+    Under gunicorn.conf.py this runs once in the parent before any worker is
+    forked, so every worker starts with the results already in memory.
+    """
+    started = time.perf_counter()
+
+    # Story templates: fill the selection memo for every combination the UI offers
+    for genre, tone in itertools.product(WARM_UP_GENRES, WARM_UP_TONES):
+        story = story_generator.generate_story('warm-up', genre, tone)
+    # PDF styles: lay a story out once per theme, reportlab loads fonts and metrics lazily
+    for theme in THEMES.values():
+        render_story_pdf(story, theme, {})
+
+    images = warm_image_cache(WARM_UP_IMAGE_DEADLINE) if WARM_IMAGE_CACHE else 0
+    # Derivatives queued while preloading are rendered now rather than once per worker
+    image_derivatives.flush()
+    # Keep-alive sockets must not be shared with forked workers
+    image_fetcher.session.close()
+
+    warm_up_state.update(ready=True, seconds=round(time.perf_counter() - started, 3), images=images)
+    print(f"Warm-up finished in {warm_up_state['seconds']}s, {images} images cached locally")
+
 @app.route('/api/generate-story', methods=['POST'])
 def generate_story():
     """Generate a complete story with images"""
@@ -156,33 +495,114 @@ def generate_story():
         # We're always in demo mode now
         pass
         
-        # Generate the story structure
-        story_data = story_generator.generate_story(idea, genre, tone, audience, art_style)
+        ttl = None
         
-        if not story_data or not isinstance(story_data, dict) or 'scenes' not in story_data:
-            return jsonify({'error': 'Failed to generate a valid story structure'}), 500
+        def build():
+            nonlocal ttl
+            # Generate the story structure
+            story_data = story_generator.generate_story(idea, genre, tone, audience, art_style)
+            
+            if not story_data or not isinstance(story_data, dict) or 'scenes' not in story_data:
+                raise ValueError('Failed to generate a valid story structure')
+            
+            # Generate images for all scenes in parallel
+            story_generator.generate_scene_images(story_data['scenes'], art_style, genre=genre)
+            
+            ttl = story_response_ttl(story_data)
+            return app.json.dumps(story_data)
         
-        # Generate images for each scene
-        for scene in story_data['scenes']:
-            try:
-                image_url = story_generator.generate_image(scene['image_prompt'], art_style)
-                if not image_url:
-                    raise ValueError("Failed to generate image")
-                scene['image_url'] = image_url
-            except Exception as img_error:
-                print(f"Error generating image for scene {scene.get('scene_number')}: {img_error}")
-                # Try one more time with a simplified prompt
-                try:
-                    simplified_prompt = f"Create a {art_style} style image of: {scene['title']}"
-                    image_url = story_generator.generate_image(simplified_prompt, art_style)
-                    scene['image_url'] = image_url if image_url else None
-                except:
-                    scene['image_url'] = None
+        # Identical requests are served from the cache; concurrent ones share a single build
+        body = story_response_cache.get_or_compute(
+            story_request_key(idea, genre, tone, audience, art_style), build, ttl_for=lambda _: ttl
+        )
+        return Response(body, mimetype='application/json')
         
-        return jsonify(story_data)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def format_stream_event(event, sse=False):
+    """Encode one streaming event as an NDJSON line or a Server-Sent Event"""
+    payload = json.dumps(event)
+    if sse:
+        return f"event: {event['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+@app.route('/api/generate-story/stream', methods=['POST'])
+def generate_story_stream():
+    """Stream a story: the header first, then each scene as soon as its image is ready"""
+    try:
+        data = request.json
+        idea = data.get('idea', '').strip()
+        genre = data.get('genre', 'fantasy')
+        tone = data.get('tone', 'adventurous')
+        audience = data.get('audience', 'general')
+        art_style = data.get('art_style', 'realistic')
+        
+        if not idea:
+            return jsonify({'error': 'Story idea is required'}), 400
+        
+        # The header is ready straight away; scene text is rendered as the stream consumes it
+        story, scenes = story_generator.story_outline(idea, genre, tone, audience, art_style)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    # NDJSON by default, Server-Sent Events when the client asks for them
+    sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+    
+    def events():
+        yield format_stream_event({
+            'type': 'story',
+            'title': story['title'],
+            'genre': story['genre'],
+            'theme': story['theme'],
+            'scene_count': story['scene_count']
+        }, sse)
+        
+        try:
+            for scene in story_generator.iter_scene_images(scenes, art_style, genre=genre):
+                yield format_stream_event({'type': 'scene', 'scene': scene}, sse)
+        except Exception as e:
+            yield format_stream_event({'type': 'error', 'error': str(e)}, sse)
+            return
+        
+        yield format_stream_event({'type': 'done'}, sse)
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream' if sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# How many batch stories may wait on their images at once
+STORY_BATCH_WINDOW = int(os.environ.get('STORY_BATCH_WINDOW', '32'))
+# Batch downloads get their own pool so a large batch can't starve interactive requests. Its size is
+# independent of IMAGE_FETCH_WORKERS: raise it for faster batches if the image source allows the traffic
+STORY_BATCH_FETCH_WORKERS = int(os.environ.get('STORY_BATCH_FETCH_WORKERS', '8'))
+batch_image_pool = ThreadPoolExecutor(max_workers=STORY_BATCH_FETCH_WORKERS, thread_name_prefix='batch-image-fetch')
+
+@app.route('/api/generate-story/batch', methods=['POST'])
+def batch_generate_stories():
+    """Generate many stories from a JSON array or JSON Lines body, streamed back as JSON Lines"""
+    try:
+        story_requests = parse_story_requests(request.get_data(as_text=True))
+        # Pull the first request now so a malformed array fails with a 400
+        first = next(story_requests, None)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid batch: {e}'}), 400
+    if first is None:
+        return jsonify({'error': 'At least one story request is required'}), 400
+    
+    def lines():
+        all_requests = itertools.chain([first], story_requests)
+        for result in generate_story_batch(story_generator, all_requests, batch_image_pool, STORY_BATCH_WINDOW):
+            yield json.dumps(result) + "\n"
+    
+    return Response(
+        stream_with_context(lines()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/api/regenerate-scene', methods=['POST'])
 def regenerate_scene():
@@ -198,27 +618,19 @@ def regenerate_scene():
         
         if regenerate_type in ['text', 'both']:
             try:
-                # Enhance the text without API - add more descriptive elements
-                words = scene_text.split()
-                if len(words) > 10:
-                    # Add some descriptive elements and improve formatting
-                    enhanced_text = scene_text.replace(".", ".\n").replace("!", "!\n")
-                    # Add some creative enhancements
-                    if "robot" in scene_text.lower():
-                        enhanced_text = enhanced_text.replace("robot", "mechanical being")
-                    if "door" in scene_text.lower():
-                        enhanced_text = enhanced_text.replace("door", "mysterious portal")
-                    result['new_text'] = enhanced_text
-                else:
-                    result['new_text'] = scene_text
+                result['new_text'] = story_generator.enhance_text(scene_text)
             except Exception as e:
                 result['new_text'] = scene_text
+            # Optionally enhance a whole story's scenes in the same request
+            if isinstance(data.get('scene_texts'), list):
+                result['new_texts'] = story_generator.enhance_texts([str(text) for text in data['scene_texts']])
         
         if regenerate_type in ['image', 'both']:
             try:
                 # Try to generate a new image
                 image_url = story_generator.generate_image(image_prompt, art_style)
                 result['new_image_url'] = image_url
+                result['new_image_srcset'] = story_generator.image_srcset(image_url)
             except Exception as e:
                 # Fallback: Use demo image based on the prompt
                 result['new_image_url'] = story_generator.get_demo_image(image_prompt, art_style)
@@ -245,114 +657,9 @@ def export_pdf():
         if not story_data:
             return jsonify({'error': 'Story data is required'}), 400
         
-        # Create PDF with custom styling
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=letter,
-            topMargin=72,
-            bottomMargin=72,
-            leftMargin=72,
-            rightMargin=72
-        )
-        styles = getSampleStyleSheet()
-        
-        # Create custom styles
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=32,
-            spaceAfter=30,
-            alignment=1,  # Center
-            textColor='#2C3E50',
-            fontName='Helvetica-Bold'
-        )
-        
-        scene_title_style = ParagraphStyle(
-            'SceneTitle',
-            parent=styles['Heading2'],
-            fontSize=24,
-            spaceBefore=30,
-            spaceAfter=20,
-            textColor='#34495E',
-            fontName='Helvetica-Bold'
-        )
-        
-        scene_text_style = ParagraphStyle(
-            'SceneText',
-            parent=styles['Normal'],
-            fontSize=12,
-            leading=16,
-            spaceBefore=12,
-            spaceAfter=12,
-            textColor='#2C3E50',
-            fontName='Helvetica'
-        )
-        
-        story = []
-        
-        # Add cover page
-        story.append(Paragraph(story_data['title'], title_style))
-        story.append(Spacer(1, 40))
-        
-        # Add metadata
-        if 'genre' in story_data:
-            meta_style = ParagraphStyle(
-                'MetaStyle',
-                parent=styles['Normal'],
-                fontSize=14,
-                textColor='#7F8C8D',
-                alignment=1
-            )
-            story.append(Paragraph(f"Genre: {story_data['genre'].title()}", meta_style))
-            story.append(Spacer(1, 10))
-        
-        story.append(Paragraph("Generated with AI Storyteller", meta_style))
-        story.append(Spacer(1, 60))
-        
-        # Add each scene with improved formatting
-        for scene in story_data['scenes']:
-            # Scene header with number and title
-            scene_header = f"Scene {scene['scene_number']}: {scene['title']}"
-            story.append(Paragraph(scene_header, scene_title_style))
-            
-            # Scene text with better formatting
-            paragraphs = scene['text'].split('\n\n')
-            for p in paragraphs:
-                if p.strip():
-                    story.append(Paragraph(p.strip(), scene_text_style))
-            
-            # Add image if available
-            if 'image_url' in scene:
-                try:
-                    # Download and add the image
-                    import requests
-                    img_response = requests.get(scene['image_url'])
-                    if img_response.status_code == 200:
-                        img_temp = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-                        img_temp.write(img_response.content)
-                        img_temp.close()
-                        
-                        # Add image with proper sizing and spacing
-                        img = Image.open(img_temp.name)
-                        aspect = img.height / img.width
-                        img_width = 400  # Fixed width in points
-                        img_height = img_width * aspect
-                        
-                        story.append(Spacer(1, 20))
-                        story.append(RLImage(img_temp.name, width=img_width, height=img_height))
-                        story.append(Spacer(1, 20))
-                        
-                        # Clean up
-                        os.unlink(img_temp.name)
-                except Exception as e:
-                    print(f"Error adding image to PDF: {e}")
-            
-            # Add page break between scenes
-            story.append(PageBreak())
-        
-        doc.build(story)
-        buffer.seek(0)
+        # Optional theme, or one picked from the requested audience / art style
+        theme = get_theme(data.get('theme'), data.get('art_style'), data.get('audience'))
+        buffer = build_story_pdf(story_data, theme)
         
         return send_file(
             buffer,
@@ -364,6 +671,56 @@ def export_pdf():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def pdf_job_response(job):
+    """Add status and download links to a PDF job"""
+    job['status_url'] = f"/api/export-pdf/jobs/{job['job_id']}"
+    job['download_url'] = f"/api/export-pdf/jobs/{job['job_id']}/download" if job['status'] == 'done' else None
+    return job
+
+@app.route('/api/export-pdf/jobs', methods=['POST'])
+def submit_pdf_job():
+    """Queue a story for PDF rendering and return a job id right away"""
+    try:
+        data = request.json
+        story_data = data.get('story')
+        
+        if not story_data:
+            return jsonify({'error': 'Story data is required'}), 400
+        
+        theme = get_theme(data.get('theme'), data.get('art_style'), data.get('audience'))
+        job = pdf_jobs.submit(story_data, theme)
+        
+        return jsonify(pdf_job_response(job)), 200 if job['status'] == 'done' else 202
+        
+    except PdfQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export-pdf/jobs/<job_id>', methods=['GET'])
+def pdf_job_status(job_id):
+    """Report the status of a PDF job"""
+    job = pdf_jobs.status(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(pdf_job_response(job))
+
+@app.route('/api/export-pdf/jobs/<job_id>/download', methods=['GET'])
+def download_pdf_job(job_id):
+    """Download the PDF of a finished job"""
+    job = pdf_jobs.status(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify(pdf_job_response(job)), 409
+    
+    return send_file(
+        os.path.abspath(pdf_jobs.path(job_id)),
+        as_attachment=True,
+        download_name=job['filename'],
+        mimetype='application/pdf'
+    )
+
 @app.route('/api/ask', methods=['POST'])
 def ask_question():
     """Ask a question and get both text response and related image"""
@@ -376,28 +733,13 @@ def ask_question():
             
         # Generate a simple response without API
         try:
-            # Create a simple response based on the question
-            question_lower = question.lower()
-            
-            if "robot" in question_lower:
-                text_response = "Robots are fascinating mechanical beings that can perform various tasks. They represent the intersection of technology and intelligence, often serving as helpers, companions, or even protagonists in stories."
-                image_prompt = "A friendly robot in a futuristic setting"
-            elif "door" in question_lower:
-                text_response = "Doors are portals to new possibilities. They can lead to adventure, mystery, or discovery. In stories, doors often symbolize transitions and new beginnings."
-                image_prompt = "A mysterious door in an ancient setting"
-            elif "story" in question_lower:
-                text_response = "Stories are powerful tools for imagination and learning. They transport us to different worlds, teach us lessons, and help us understand complex ideas through narrative."
-                image_prompt = "A magical storybook opening with light"
-            else:
-                text_response = f"That's an interesting question about '{question}'. While I'm running in demo mode, I can tell you that this topic is worth exploring further through research and creative thinking."
-                image_prompt = f"A creative illustration related to {question}"
-            
-            # Generate image
-            image_url = story_generator.generate_image(image_prompt)
+            # Canned answer for the closest intent; its image is resolved once and reused
+            text_response, image_url = story_generator.answer_question(question)
             
             return jsonify({
                 'answer': text_response,
-                'image_url': image_url
+                'image_url': image_url,
+                'image_srcset': story_generator.image_srcset(image_url)
             })
             
         except Exception as e:
@@ -420,15 +762,9 @@ def share_story():
         if not story_data:
             return jsonify({'error': 'Story data is required'}), 400
         
-        # Generate a unique ID for the story
-        import uuid
-        story_id = str(uuid.uuid4())
-        
-        # Store the story data (in a real app, this would go to a database)
-        # For now, we'll store it in memory (note: this is temporary and will be lost on server restart)
-        if not hasattr(app, 'shared_stories'):
-            app.shared_stories = {}
-        app.shared_stories[story_id] = story_data
+        # Identical stories share one stored copy and keep their existing ID
+        story_id = shared_stories.share(story_data)
+        pin_shared_images(story_id, story_data)
         
         # Create the shareable URL
         share_url = f"{request.host_url}story/{story_id}"
@@ -445,10 +781,7 @@ def share_story():
 def view_shared_story(story_id):
     """Retrieve a shared story"""
     try:
-        if not hasattr(app, 'shared_stories'):
-            return jsonify({'error': 'Story not found'}), 404
-            
-        story_data = app.shared_stories.get(story_id)
+        story_data = shared_stories.get(story_id)
         if not story_data:
             return jsonify({'error': 'Story not found'}), 404
             
@@ -476,13 +809,48 @@ def test_openai():
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'message': 'AI Storyteller API is running'})
+    return jsonify({
+        'status': 'healthy',
+        'message': 'AI Storyteller API is running',
+        'image_cache': image_cache.stats(),
+        'image_storage': storage_sweeper.stats(),
+        'story_cache': story_response_cache.stats()
+    })
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 200 once warm-up has finished, 503 until then"""
+    return jsonify(dict(warm_up_state, pid=os.getpid())), 200 if warm_up_state['ready'] else 503
 
-@app.route('/static/<filename>')
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose timings, fallbacks and cache counters in the Prometheus text format"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/static/<path:filename>')
 def serve_static(filename):
-    """Serve static images"""
-    return send_from_directory('static', filename)
+    """Serve static images with strong ETags, conditional GET and byte ranges"""
+    asset = static_assets.lookup(filename)
+    if asset is None:
+        abort(404)
+
+    headers = static_assets.headers(asset)
+    if static_assets.etag_matches(asset, request.headers.get('If-None-Match')):
+        return Response(status=304, headers=headers)
+
+    try:
+        f = open(asset.path, 'rb')
+    except OSError:
+        # Removed since its metadata was cached
+        static_assets.forget(filename)
+        abort(404)
+
+    response = Response(wrap_file(request.environ, f), mimetype=asset.mimetype, headers=headers,
+                        direct_passthrough=True)
+    response.content_length = asset.size
+    return response.make_conditional(request, accept_ranges=True, complete_length=asset.size)
 
 if __name__ == '__main__':
+    warm_up()
     app.run(debug=True, port=5000)
     
\ No newline at end of file
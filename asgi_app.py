@@ -0,0 +1,534 @@
+"""Asyncio serving mode for the story API.
+
+Exposes the same endpoints and JSON contracts as the Flask app in app.py, but
+downloads images with a non-blocking HTTP client so a single process can keep
+many story generations in flight. Run with:
+
+    uvicorn asgi_app:app --port 5000
+"""
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import time
+import unicodedata
+from urllib.parse import quote
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from app import (
+    story_generator, image_cache, static_assets, shared_stories, story_response_cache, storage_sweeper,
+    pin_shared_images, build_story_pdf, format_stream_event, pdf_jobs, pdf_job_response, batch_image_pool,
+    story_response_ttl,
+    warm_up, warm_up_state, IMAGE_FETCH_WORKERS, STORY_IMAGE_DEADLINE, STORY_BATCH_WINDOW
+)
+from image_cache import StorageQuotaExceeded
+from image_download import ImageDownloadError
+from image_fetcher import AsyncImageFetcher, CircuitOpenError
+from pdf_jobs import PdfQueueFull
+from pdf_themes import get_theme
+from story_cache import story_request_key
+from story_batch import parse_story_requests, generate_story_batch
+import metrics
+
+image_fetcher = AsyncImageFetcher(
+    pool_size=IMAGE_FETCH_WORKERS,
+    connect_timeout=float(os.environ.get('IMAGE_FETCH_CONNECT_TIMEOUT', '3.05')),
+    read_timeout=float(os.environ.get('IMAGE_FETCH_READ_TIMEOUT', '10')),
+    retries=int(os.environ.get('IMAGE_FETCH_RETRIES', '2'))
+)
+
+async def generate_image(prompt, art_style="realistic", source_url=None):
+    """Async counterpart of StoryGenerator.generate_image"""
+    try:
+        image_url = source_url
+        if not image_url:
+            with metrics.span('image_selection'):
+                image_url = story_generator.image_selector.get_scene_specific_image(
+                    prompt, "fantasy", "default", key=prompt
+                )
+
+        cached_url = image_cache.get(image_url)
+        if cached_url:
+            return cached_url
+
+        try:
+            with metrics.span('image_download'):
+                img_response = await image_fetcher.get(image_url, stream=True)
+                try:
+                    if img_response.status_code == 200:
+                        # Chunks are hashed and written off the event loop
+                        return await story_generator.image_downloader.store_async(image_url, img_response)
+                finally:
+                    await img_response.aclose()
+            print(f"Failed to download image: {img_response.status_code}")
+            metrics.fallback('download_status')
+            return image_url
+        except CircuitOpenError as e:
+            print(f"Skipping download: {e}")
+            metrics.fallback('circuit_open')
+            return story_generator.image_selector.get_demo_image()
+        except StorageQuotaExceeded as e:
+            print(f"Not storing image locally: {e}")
+            metrics.fallback('storage_quota')
+            return image_url
+        except ImageDownloadError as e:
+            print(f"Rejected downloaded image: {e}")
+            metrics.fallback('invalid_image')
+            return story_generator.image_selector.get_demo_image()
+        except Exception as e:
+            print(f"Error saving image locally: {e}")
+            metrics.fallback('download_error')
+            return image_url
+
+    except Exception as e:
+        print(f"Error generating image: {e}")
+        metrics.fallback('demo_image')
+        return story_generator.get_demo_image(prompt, art_style)
+
+async def generate_scene_image(scene, art_style="realistic", source_url=None):
+    """Generate the image for one scene, retrying once with a simplified prompt"""
+    try:
+        image_url = await generate_image(scene['image_prompt'], art_style, source_url)
+        if not image_url:
+            raise ValueError("Failed to generate image")
+        return image_url
+    except Exception as img_error:
+        print(f"Error generating image for scene {scene.get('scene_number')}: {img_error}")
+        metrics.fallback('simplified_prompt')
+        try:
+            simplified_prompt = f"Create a {art_style} style image of: {scene['title']}"
+            image_url = await generate_image(simplified_prompt, art_style)
+            return image_url if image_url else None
+        except Exception:
+            return None
+
+async def iter_scene_images(scenes, art_style="realistic", deadline=None, genre=None):
+    """Fetch the images for all scenes concurrently, yielding each scene as soon as it is ready"""
+    if deadline is None:
+        deadline = STORY_IMAGE_DEADLINE
+
+    # Scenes may arrive as a generator; image selection needs the whole story
+    scenes = list(scenes)
+    with metrics.span('image_selection'):
+        source_urls = story_generator.image_selector.select_story_images([scene['image_prompt'] for scene in scenes], genre)
+
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + deadline
+    tasks = {
+        asyncio.ensure_future(generate_scene_image(scene, art_style, source_url)): (scene, source_url)
+        for scene, source_url in zip(scenes, source_urls)
+    }
+    pending = set(tasks)
+
+    while pending:
+        done, pending = await asyncio.wait(
+            pending, timeout=max(0, give_up_at - loop.time()), return_when=asyncio.FIRST_COMPLETED
+        )
+        if not done:
+            break
+        for task in done:
+            scene, _ = tasks[task]
+            story_generator.attach_image(scene, task.result())
+            yield scene
+
+    for task in pending:
+        task.cancel()
+        scene, source_url = tasks[task]
+        print(f"Image for scene {scene.get('scene_number')} missed the {deadline}s deadline")
+        metrics.fallback('deadline')
+        story_generator.attach_image(scene, source_url)
+        yield scene
+
+async def generate_scene_images(scenes, art_style="realistic", deadline=None, genre=None):
+    """Fetch the images for all scenes concurrently, keeping the scene order"""
+    async for _ in iter_scene_images(scenes, art_style, deadline, genre):
+        pass
+    return scenes
+
+async def generate_story(request):
+    """Generate a complete story with images"""
+    try:
+        data = await request.json()
+        idea = data.get('idea', '').strip()
+        genre = data.get('genre', 'fantasy')
+        tone = data.get('tone', 'adventurous')
+        audience = data.get('audience', 'general')
+        art_style = data.get('art_style', 'realistic')
+
+        if not idea:
+            return JSONResponse({'error': 'Story idea is required'}, status_code=400)
+
+        ttl = None
+
+        async def build():
+            nonlocal ttl
+            story_data = story_generator.generate_story(idea, genre, tone, audience, art_style)
+
+            if not story_data or not isinstance(story_data, dict) or 'scenes' not in story_data:
+                raise ValueError('Failed to generate a valid story structure')
+
+            await generate_scene_images(story_data['scenes'], art_style, genre=genre)
+
+            ttl = story_response_ttl(story_data)
+            return json.dumps(story_data)
+
+        body = await story_response_cache.get_or_compute_async(
+            story_request_key(idea, genre, tone, audience, art_style), build, ttl_for=lambda _: ttl
+        )
+        return Response(body, media_type='application/json')
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def generate_story_stream(request):
+    """Stream a story: the header first, then each scene as soon as its image is ready"""
+    try:
+        data = await request.json()
+        idea = data.get('idea', '').strip()
+        genre = data.get('genre', 'fantasy')
+        tone = data.get('tone', 'adventurous')
+        audience = data.get('audience', 'general')
+        art_style = data.get('art_style', 'realistic')
+
+        if not idea:
+            return JSONResponse({'error': 'Story idea is required'}, status_code=400)
+
+        story, scenes = story_generator.story_outline(idea, genre, tone, audience, art_style)
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+    sse = request.query_params.get('format') == 'sse' or 'text/event-stream' in request.headers.get('accept', '')
+
+    async def events():
+        yield format_stream_event({
+            'type': 'story',
+            'title': story['title'],
+            'genre': story['genre'],
+            'theme': story['theme'],
+            'scene_count': story['scene_count']
+        }, sse)
+
+        try:
+            async for scene in iter_scene_images(scenes, art_style, genre=genre):
+                yield format_stream_event({'type': 'scene', 'scene': scene}, sse)
+        except Exception as e:
+            yield format_stream_event({'type': 'error', 'error': str(e)}, sse)
+            return
+
+        yield format_stream_event({'type': 'done'}, sse)
+
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream' if sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def batch_generate_stories(request):
+    """Generate many stories from a JSON array or JSON Lines body, streamed back as JSON Lines"""
+    try:
+        story_requests = parse_story_requests((await request.body()).decode('utf-8'))
+        first = next(story_requests, None)
+    except ValueError as e:
+        return JSONResponse({'error': f'Invalid batch: {e}'}, status_code=400)
+    if first is None:
+        return JSONResponse({'error': 'At least one story request is required'}, status_code=400)
+
+    def lines():
+        all_requests = itertools.chain([first], story_requests)
+        for result in generate_story_batch(story_generator, all_requests, batch_image_pool, STORY_BATCH_WINDOW):
+            yield json.dumps(result) + "\n"
+
+    # A plain iterator is run in Starlette's threadpool, so the blocking batch never stalls the loop
+    return StreamingResponse(
+        lines(),
+        media_type='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def regenerate_scene(request):
+    """Regenerate a specific scene or its image"""
+    try:
+        data = await request.json()
+        scene_text = data.get('scene_text', '')
+        image_prompt = data.get('image_prompt', '')
+        art_style = data.get('art_style', 'realistic')
+        regenerate_type = data.get('type', 'both')  # 'text', 'image', or 'both'
+
+        result = {}
+
+        if regenerate_type in ['text', 'both']:
+            try:
+                result['new_text'] = story_generator.enhance_text(scene_text)
+            except Exception:
+                result['new_text'] = scene_text
+            if isinstance(data.get('scene_texts'), list):
+                result['new_texts'] = story_generator.enhance_texts([str(text) for text in data['scene_texts']])
+
+        if regenerate_type in ['image', 'both']:
+            try:
+                result['new_image_url'] = await generate_image(image_prompt, art_style)
+                result['new_image_srcset'] = story_generator.image_srcset(result['new_image_url'])
+            except Exception:
+                result['new_image_url'] = story_generator.get_demo_image(image_prompt, art_style)
+
+        if not result:
+            return JSONResponse({'error': 'No changes were made'}, status_code=400)
+
+        return JSONResponse(result)
+
+    except Exception as e:
+        print(f"Error in regenerate_scene: {str(e)}")
+        return JSONResponse({
+            'error': 'Failed to regenerate scene. Using fallback options.',
+            'details': str(e)
+        }, status_code=500)
+
+def attachment_header(filename):
+    """Content-Disposition for a download: an ASCII filename plus the RFC 5987 UTF-8 one, like Flask's send_file"""
+    fallback = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+    fallback = ''.join(c if c.isprintable() and c not in '\\"' else '_' for c in fallback) or 'download'
+    if fallback == filename:
+        return f'attachment; filename="{filename}"'
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+async def export_pdf(request):
+    """Export story as PDF"""
+    try:
+        data = await request.json()
+        story_data = data.get('story')
+
+        if not story_data:
+            return JSONResponse({'error': 'Story data is required'}, status_code=400)
+
+        # ReportLab layout is CPU-bound, keep it off the event loop
+        theme = get_theme(data.get('theme'), data.get('art_style'), data.get('audience'))
+        buffer = await asyncio.to_thread(build_story_pdf, story_data, theme)
+        filename = f"{story_data['title'].replace(' ', '_')}.pdf"
+
+        return Response(
+            buffer.getvalue(),
+            media_type='application/pdf',
+            headers={'Content-Disposition': attachment_header(filename)}
+        )
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def submit_pdf_job(request):
+    """Queue a story for PDF rendering and return a job id right away"""
+    try:
+        data = await request.json()
+        story_data = data.get('story')
+
+        if not story_data:
+            return JSONResponse({'error': 'Story data is required'}, status_code=400)
+
+        theme = get_theme(data.get('theme'), data.get('art_style'), data.get('audience'))
+        job = pdf_jobs.submit(story_data, theme)
+
+        return JSONResponse(pdf_job_response(job), status_code=200 if job['status'] == 'done' else 202)
+
+    except PdfQueueFull as e:
+        return JSONResponse({'error': str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def pdf_job_status(request):
+    """Report the status of a PDF job"""
+    job = pdf_jobs.status(request.path_params['job_id'])
+    if not job:
+        return JSONResponse({'error': 'Job not found'}, status_code=404)
+    return JSONResponse(pdf_job_response(job))
+
+async def download_pdf_job(request):
+    """Download the PDF of a finished job"""
+    job_id = request.path_params['job_id']
+    job = pdf_jobs.status(job_id)
+    if not job:
+        return JSONResponse({'error': 'Job not found'}, status_code=404)
+    if job['status'] != 'done':
+        return JSONResponse(pdf_job_response(job), status_code=409)
+
+    return FileResponse(pdf_jobs.path(job_id), media_type='application/pdf', filename=job['filename'])
+
+async def ask_question(request):
+    """Ask a question and get both text response and related image"""
+    try:
+        data = await request.json()
+        question = data.get('question', '')
+
+        if not question:
+            return JSONResponse({'error': 'Question is required'}, status_code=400)
+
+        try:
+            match, key, cached = story_generator.match_question(question)
+            if cached is not None:
+                text_response, image_url = cached
+            else:
+                source_url = story_generator.question_image_source(match)
+                image_url = await generate_image(match.image_prompt, source_url=source_url)
+                story_generator.remember_answer(key, match.answer, image_url, source_url)
+                text_response = match.answer
+
+            return JSONResponse({
+                'answer': text_response,
+                'image_url': image_url,
+                'image_srcset': story_generator.image_srcset(image_url)
+            })
+
+        except Exception as e:
+            print(f"Error in ask_question: {str(e)}")
+            return JSONResponse({
+                'error': 'Failed to generate response',
+                'details': str(e)
+            }, status_code=500)
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def share_story(request):
+    """Create a shareable link for the story"""
+    try:
+        data = await request.json()
+        story_data = data.get('story')
+
+        if not story_data:
+            return JSONResponse({'error': 'Story data is required'}, status_code=400)
+
+        story_id = await asyncio.to_thread(shared_stories.share, story_data)
+        await asyncio.to_thread(pin_shared_images, story_id, story_data)
+
+        return JSONResponse({
+            'share_url': f"{request.base_url}story/{story_id}",
+            'story_id': story_id
+        })
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def view_shared_story(request):
+    """Retrieve a shared story"""
+    try:
+        story_data = await asyncio.to_thread(shared_stories.get, request.path_params['story_id'])
+        if not story_data:
+            return JSONResponse({'error': 'Story not found'}, status_code=404)
+
+        return JSONResponse(story_data)
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def test_openai(request):
+    """Test demo mode functionality"""
+    return JSONResponse({
+        'status': 'success',
+        'message': 'Demo mode is working correctly - no API key required',
+        'api_response': 'Demo mode active - using pre-generated content'
+    })
+
+async def health_check(request):
+    """Health check endpoint"""
+    return JSONResponse({
+        'status': 'healthy',
+        'message': 'AI Storyteller API is running',
+        'image_cache': image_cache.stats(),
+        'image_storage': storage_sweeper.stats(),
+        'story_cache': story_response_cache.stats()
+    })
+
+async def serve_static(request):
+    """Serve static images with strong ETags, conditional GET and byte ranges"""
+    filename = request.path_params['filename']
+    asset = static_assets.lookup(filename)
+    if asset is None:
+        return Response(status_code=404)
+
+    headers = static_assets.headers(asset)
+    if static_assets.etag_matches(asset, request.headers.get('if-none-match')):
+        return Response(status_code=304, headers=headers)
+
+    # Passing the cached stat result keeps FileResponse from stat-ing again
+    return FileResponse(asset.path, headers=headers, media_type=asset.mimetype, stat_result=asset.stat)
+
+async def readiness_check(request):
+    """Readiness probe: 200 once warm-up has finished, 503 until then"""
+    return JSONResponse(dict(warm_up_state, pid=os.getpid()), status_code=200 if warm_up_state['ready'] else 503)
+
+async def metrics_endpoint(request):
+    """Expose timings, fallbacks and cache counters in the Prometheus text format"""
+    return Response(metrics.registry.render(), media_type='text/plain; version=0.0.4')
+
+class RequestTimingMiddleware:
+    """Record each request's duration in the per-route latency histogram"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router fills in the endpoint; named like the Flask view functions
+            endpoint = scope.get('endpoint')
+            metrics.request_seconds.observe(
+                time.perf_counter() - started,
+                route=getattr(endpoint, '__name__', 'unmatched'), method=scope['method'], status=status[0]
+            )
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await image_fetcher.start()
+    if not warm_up_state['ready']:
+        await asyncio.to_thread(warm_up)
+    try:
+        yield
+    finally:
+        await image_fetcher.close()
+
+app = Starlette(
+    routes=[
+        Route('/api/generate-story', generate_story, methods=['POST']),
+        Route('/api/generate-story/stream', generate_story_stream, methods=['POST']),
+        Route('/api/generate-story/batch', batch_generate_stories, methods=['POST']),
+        Route('/api/regenerate-scene', regenerate_scene, methods=['POST']),
+        Route('/api/export-pdf', export_pdf, methods=['POST']),
+        Route('/api/export-pdf/jobs', submit_pdf_job, methods=['POST']),
+        Route('/api/export-pdf/jobs/{job_id}', pdf_job_status, methods=['GET']),
+        Route('/api/export-pdf/jobs/{job_id}/download', download_pdf_job, methods=['GET']),
+        Route('/api/ask', ask_question, methods=['POST']),
+        Route('/api/share', share_story, methods=['POST']),
+        Route('/story/{story_id}', view_shared_story),
+        Route('/api/test-openai', test_openai, methods=['GET']),
+        Route('/api/health', health_check, methods=['GET']),
+        Route('/api/ready', readiness_check, methods=['GET']),
+        Route('/api/metrics', metrics_endpoint, methods=['GET']),
+        Route('/static/{filename:path}', serve_static, methods=['GET', 'HEAD'])
+    ],
+    middleware=[
+        Middleware(RequestTimingMiddleware),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+    ],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=5000)
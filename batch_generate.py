@@ -0,0 +1,62 @@
+"""Generate stories in bulk from the command line.
+
+Reads story requests (JSON Lines, or one JSON array) from a file or stdin
+and writes one JSON result per line, in input order:
+
+    python batch_generate.py requests.jsonl -o stories.jsonl
+
+Each request takes the same fields as /api/generate-story, plus an optional
+"id" that is copied to its result.
+"""
+import argparse
+import contextlib
+import json
+import sys
+import time
+
+from story_batch import parse_story_requests, generate_story_batch
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate stories in bulk')
+    parser.add_argument('input', nargs='?', default='-', help='JSON Lines or JSON array file (default: stdin)')
+    parser.add_argument('-o', '--output', default='-', help='JSON Lines output file (default: stdout)')
+    parser.add_argument('--window', type=int, default=None,
+                        help='stories kept in flight while their images download (default: STORY_BATCH_WINDOW)')
+    args = parser.parse_args(argv)
+
+    if args.input == '-':
+        text = sys.stdin.read()
+    else:
+        with open(args.input, encoding='utf-8') as f:
+            text = f.read()
+
+    try:
+        # A malformed JSON array can't be split into requests, so it fails the whole run here
+        story_requests = list(parse_story_requests(text))
+    except ValueError as e:
+        print(f"Invalid JSON input: {e}", file=sys.stderr)
+        return 2
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    started = time.time()
+    count = failed = 0
+    # The app logs with print(), which must not end up in the results
+    with contextlib.redirect_stdout(sys.stderr):
+        from app import story_generator, image_fetch_pool, STORY_BATCH_WINDOW
+
+        window = args.window or STORY_BATCH_WINDOW
+        try:
+            for result in generate_story_batch(story_generator, story_requests, image_fetch_pool, window):
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+                count += 1
+                failed += 'error' in result
+        finally:
+            if args.output != '-':
+                output.close()
+
+    print(f"Generated {count - failed} stories ({failed} failed) in {time.time() - started:.1f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
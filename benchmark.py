@@ -0,0 +1,288 @@
+"""Benchmark the story API against a local stand-in for the image CDN.
+
+Starts an HTTP server that serves synthetic JPEGs with a configurable delay
+and size, points ImageSelector at it, runs the app in a fresh temporary
+working directory and measures throughput and latency percentiles for each
+endpoint at several concurrency levels. Results are written as JSON:
+
+    python benchmark.py --concurrency 1,4,16 --requests 64 --output bench.json
+
+Nothing here touches the network, so runs are reproducible offline.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ENDPOINTS = ('generate-story', 'regenerate-scene', 'ask', 'export-pdf')
+
+class StandInImageServer:
+    """Serves a distinct synthetic JPEG for every path after a fixed delay"""
+
+    def __init__(self, latency=0.05, width=1024, height=768, quality=85):
+        self.latency = latency
+        self.width = width
+        self.height = height
+        self.quality = quality
+        self.requests = 0
+
+        self._lock = threading.Lock()
+        self._images = {}
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stand-in-images', daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def image(self, path):
+        """Return the JPEG bytes for a path, rendered once per path"""
+        with self._lock:
+            data = self._images.get(path)
+        if data is None:
+            # Colour and noise derived from the path, so every URL is a different image
+            digest = hashlib.sha256(path.encode('utf-8')).digest()
+            img = Image.effect_noise((self.width, self.height), 24 + digest[3] % 40).convert('RGB')
+            img = Image.blend(img, Image.new('RGB', img.size, tuple(digest[:3])), 0.5)
+            output = io.BytesIO()
+            img.save(output, format='JPEG', quality=self.quality)
+            data = output.getvalue()
+            with self._lock:
+                self._images[path] = data
+        return data
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                data = server.image(self.path)
+                time.sleep(server.latency)
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+def summarize(endpoint, concurrency, latencies, errors, elapsed):
+    latencies_ms = sorted(l * 1000 for l in latencies)
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 4),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': percentile(latencies_ms, 50),
+            'p95': percentile(latencies_ms, 95),
+            'p99': percentile(latencies_ms, 99),
+            'mean': statistics.fmean(latencies_ms) if latencies_ms else None,
+            'max': latencies_ms[-1] if latencies_ms else None
+        }
+    }
+
+class Benchmark:
+    """Fires requests at one running API server and records their latencies"""
+
+    def __init__(self, api_url, sample_story):
+        self.api_url = api_url
+        self.sample_story = sample_story
+        self._local = threading.local()
+        self._counter = 0
+        self._counter_lock = threading.Lock()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _next(self):
+        with self._counter_lock:
+            self._counter += 1
+            return self._counter
+
+    def request(self, endpoint):
+        """Send one request and return its latency, raising on failure"""
+        n = self._next()
+        if endpoint == 'generate-story':
+            # A new idea each time, so the story response cache doesn't answer everything
+            path, payload = '/api/generate-story', {'idea': f"a robot exploring a hidden door {n}", 'genre': 'scifi'}
+        elif endpoint == 'regenerate-scene':
+            scene = self.sample_story['scenes'][n % len(self.sample_story['scenes'])]
+            path, payload = '/api/regenerate-scene', {
+                'scene_text': scene['text'], 'image_prompt': f"{scene['image_prompt']} {n}", 'type': 'both'
+            }
+        elif endpoint == 'ask':
+            path, payload = '/api/ask', {'question': f"What makes a good mystery story? ({n})"}
+        elif endpoint == 'export-pdf':
+            path, payload = '/api/export-pdf', {'story': self.sample_story}
+        else:
+            raise ValueError(f"Unknown endpoint: {endpoint}")
+
+        started = time.perf_counter()
+        response = self._session().post(self.api_url + path, json=payload, timeout=120)
+        latency = time.perf_counter() - started
+        response.raise_for_status()
+        return latency
+
+    def run(self, endpoint, concurrency, count):
+        latencies, errors = [], 0
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            started = time.perf_counter()
+            futures = [pool.submit(self.request, endpoint) for _ in range(count)]
+            for future in futures:
+                try:
+                    latencies.append(future.result())
+                except Exception as e:
+                    errors += 1
+                    print(f"{endpoint} request failed: {e}", file=sys.stderr)
+            elapsed = time.perf_counter() - started
+        return summarize(endpoint, concurrency, latencies, errors, elapsed)
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the story API against a local image server')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=32, help='requests per endpoint and concurrency level')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='comma-separated endpoints to measure')
+    parser.add_argument('--latency-ms', type=float, default=50, help='delay before the stand-in serves an image')
+    parser.add_argument('--image-size', default='1024x768', help='stand-in image dimensions, WIDTHxHEIGHT')
+    parser.add_argument('--image-quality', type=int, default=85, help='stand-in JPEG quality')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests per endpoint before timing')
+    parser.add_argument('-o', '--output', default='-', help='JSON results file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(',')]
+    width, height = (int(v) for v in args.image_size.lower().split('x'))
+    output_path = os.path.abspath(args.output) if args.output != '-' else None
+
+    # The app logs with print(); keep stdout for the JSON report
+    report_out, sys.stdout = sys.stdout, sys.stderr
+
+    images = StandInImageServer(args.latency_ms / 1000, width, height, args.image_quality).start()
+
+    # The app keeps its image cache and stores relative to the working directory,
+    # so every run starts cold in a scratch directory
+    workdir = tempfile.mkdtemp(prefix='storyteller-bench-')
+    os.chdir(workdir)
+    os.environ['IMAGE_BASE_URL'] = images.base_url
+    os.environ.setdefault('STORY_STORE', 'memory')
+    # The sample story is reused for exports, so keep them from becoming cache hits
+    os.environ.setdefault('STORY_RESPONSE_CACHE_SIZE', '0')
+    sys.path.insert(0, REPO_DIR)
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app import app, image_derivatives
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    api = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=api.serve_forever, name='bench-api', daemon=True).start()
+    api_url = f"http://127.0.0.1:{api.server_port}"
+
+    sample = requests.post(api_url + '/api/generate-story', json={'idea': 'a lighthouse keeper'}, timeout=120)
+    sample.raise_for_status()
+    bench = Benchmark(api_url, sample.json())
+
+    results = []
+    for endpoint in endpoints:
+        for _ in range(args.warmup):
+            bench.request(endpoint)
+        for concurrency in levels:
+            result = bench.run(endpoint, concurrency, args.requests)
+            print(f"{endpoint:>16} c={concurrency:<3} {result['throughput_rps']} req/s "
+                  f"p50={result['latency_ms']['p50']:.1f}ms p99={result['latency_ms']['p99']:.1f}ms",
+                  file=sys.stderr)
+            results.append(result)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'requests': args.requests,
+            'concurrency': levels,
+            'warmup': args.warmup,
+            'image_latency_ms': args.latency_ms,
+            'image_size': [width, height],
+            'image_bytes': len(images.image('/size-probe')),
+            'image_quality': args.image_quality
+        },
+        'image_server_requests': images.requests,
+        'results': results
+    }
+
+    api.shutdown()
+    # Let background resizing stop before its working directory goes away
+    image_derivatives.pool.shutdown(wait=True, cancel_futures=True)
+    images.stop()
+    sys.stdout = report_out
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if any(r['errors'] for r in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
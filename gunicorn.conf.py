@@ -0,0 +1,37 @@
+"""Production settings for running the Flask app under gunicorn on Linux.
+
+The app is imported and warmed up once in the master process, then forked
+into the workers, so they share its memory copy-on-write and answer their
+first request warm. Start it with ./start.sh, or:
+
+    gunicorn -c gunicorn.conf.py app:app
+"""
+import multiprocessing
+import os
+
+# Tells app.py to hold back its background threads until after the fork
+os.environ['STORYTELLER_PRELOAD'] = '1'
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', str(multiprocessing.cpu_count())))
+# Requests mostly wait on image downloads, so each worker serves several at once
+worker_class = 'gthread'
+threads = int(os.environ.get('WORKER_THREADS', '8'))
+preload_app = True
+timeout = int(os.environ.get('WORKER_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so slow leaks can't build up
+max_requests = int(os.environ.get('WORKER_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('ACCESS_LOG', '-')
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and the socket is bound, before any
+    # worker is forked; connections wait in the listen backlog meanwhile
+    from app import warm_up
+    warm_up()
+
+def post_fork(server, worker):
+    from app import start_background_work
+    start_background_work()
@@ -0,0 +1,356 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from image_storage import locked_file, shard
+
+class StorageQuotaExceeded(Exception):
+    """Raised when an image can't be stored without going over the hard byte quota"""
+
+class DiskUsage:
+    """Bytes stored in an image directory, shared by every process that writes to it.
+
+    The count lives in a small file that is read and updated under an
+    exclusive flock, so a reservation made by one worker is seen by all of
+    them. ``bytes`` is None inside ``locked()`` if the file was unreadable.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        with self._lock, locked_file(self.path) as f:
+            try:
+                self.bytes = int(f.read() or 0)
+            except ValueError:
+                self.bytes = None
+            before = self.bytes
+            try:
+                yield self
+            finally:
+                if self.bytes != before and self.bytes is not None:
+                    f.seek(0)
+                    f.truncate()
+                    f.write(str(self.bytes))
+                    f.flush()
+
+    def peek(self):
+        """Return the current count without locking, or the last one seen if it is being rewritten"""
+        try:
+            with open(self.path) as f:
+                self.bytes = int(f.read())
+        except (OSError, ValueError):
+            pass
+        return self.bytes
+
+class ImageCache:
+    """On-disk image cache keyed by source URL and content hash.
+
+    Every distinct image is stored once as ``<shard>/<sha256>.jpg``, where the
+    shard is the first two hex digits of the hash; repeat requests for a known
+    source URL are answered from disk, and the least recently used files are
+    evicted once the directory grows past ``max_bytes``. ``quota_bytes`` is a
+    hard limit: bytes are reserved before every write (originals and
+    derivatives alike), and if evicting unpinned images can't make room the
+    write is refused with StorageQuotaExceeded.
+
+    Several worker processes can share one directory. Usage is counted in a
+    DiskUsage file they all update, reservations and renames happen under its
+    lock, and every hit checks that the file is still there, since another
+    worker may have evicted it. When local bookkeeping can't free enough room
+    the directory is rescanned, which also picks up other workers' images.
+    """
+
+    FILENAME_PATTERN = re.compile(r'^[0-9a-f]{64}\.jpg$')
+    # <sha256>.jpg originals and <sha256>_<width>w.<ext> derivatives in a shard
+    SHARD_FILE_PATTERN = re.compile(r'^([0-9a-f]{64})(_\d+w\.(?:jpg|webp|avif)|\.jpg)$')
+
+    def __init__(self, directory='static', url_prefix='/static', max_bytes=512 * 1024 * 1024,
+                 on_store=None, on_evict=None, quota_bytes=None, pinned=None, touch_interval=3600,
+                 rescan_interval=3600):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self.max_bytes = max_bytes
+        self.quota_bytes = quota_bytes
+        # Optional hooks called with the content hash of every stored (even if already on disk) / evicted image
+        self.on_store = on_store
+        self.on_evict = on_evict
+        # Optional callable returning the content hashes eviction must leave alone
+        self.pinned = pinned
+        # Hits refresh a file's mtime at most this often, so the storage sweeper sees it in use
+        self.touch_interval = touch_interval
+        # A write that doesn't fit rescans the directory at most this often; the storage sweeper rescans too
+        self.rescan_interval = rescan_interval
+        self._last_rescan = None
+
+        self._lock = threading.Lock()
+        self._urls = {}                 # source URL -> content hash
+        self._entries = OrderedDict()   # content hashes of stored images, least recently used first
+        self._touched = {}              # content hash -> last mtime refresh
+        self._usage = DiskUsage(os.path.join(directory, '.usage'))
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._load_existing()
+
+    def _load_existing(self):
+        """Register images already on disk and recount the directory's usage"""
+        for name in os.listdir(self.directory):
+            if self.FILENAME_PATTERN.match(name):
+                # Stored before images were sharded; move it into its shard
+                content_hash = name[:-4]
+                os.makedirs(os.path.dirname(self._path(content_hash)), exist_ok=True)
+                os.replace(os.path.join(self.directory, name), self._path(content_hash))
+
+        with self._locked_usage() as usage:
+            self._rescan(usage)
+            self._evict(usage)
+
+    @contextmanager
+    def _locked_usage(self):
+        with self._usage.locked() as usage:
+            if usage.bytes is None:
+                self._rescan(usage)
+            yield usage
+
+    def _rescan(self, usage):
+        """Recount every file on disk and rebuild the LRU order from mtimes; called with the usage lock held"""
+        total = 0
+        files = {}  # content hash -> mtime of the original
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith('.'):
+                    continue  # Temp files are counted once they are renamed into place
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                total += stat.st_size
+                if self.FILENAME_PATTERN.match(name) and os.path.basename(root) == shard(name):
+                    files[name[:-4]] = stat.st_mtime
+        usage.bytes = total
+        self._last_rescan = time.monotonic()
+
+        now = time.time()
+        with self._lock:
+            self._entries = OrderedDict((h, None) for h in sorted(files, key=files.get))
+            self._touched = {h: min(files[h], now) for h in files}
+            self._urls = {url: h for url, h in self._urls.items() if h in files}
+
+    def rescan(self):
+        """Recount the directory, correcting usage after files were removed behind the cache's back"""
+        with self._locked_usage() as usage:
+            self._rescan(usage)
+
+    def _path(self, content_hash):
+        return os.path.join(self.directory, shard(content_hash), f"{content_hash}.jpg")
+
+    def _public_url(self, content_hash):
+        return f"{self.url_prefix}/{shard(content_hash)}/{content_hash}.jpg"
+
+    def get(self, source_url):
+        """Return the local URL for a previously stored source URL, or None"""
+        now = time.time()
+        with self._lock:
+            content_hash = self._urls.get(source_url)
+            if content_hash is None or content_hash not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(content_hash)
+            stale = now - self._touched.get(content_hash, 0) > self.touch_interval
+            if stale:
+                self._touched[content_hash] = now
+
+        try:
+            if stale:
+                os.utime(self._path(content_hash))
+            else:
+                os.stat(self._path(content_hash))
+        except FileNotFoundError:
+            # Evicted or swept by another worker; forget it and download it again
+            self._forget(content_hash)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return self._public_url(content_hash)
+
+    def contains(self, content_hash):
+        """True if an image is tracked by this cache"""
+        with self._lock:
+            return content_hash in self._entries
+
+    def put(self, source_url, content):
+        """Store image bytes for a source URL and return their local URL"""
+        # Write to a temporary name first so readers never see a partial file
+        temp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(content)
+        return self.put_file(source_url, temp_path, hashlib.sha256(content).hexdigest(), len(content))
+
+    def put_file(self, source_url, temp_path, content_hash, size):
+        """Move a completely written temporary file (in this directory) into place and return its local URL"""
+        path = self._path(content_hash)
+        try:
+            with self._locked_usage() as usage:
+                if not os.path.exists(path):
+                    self._reserve(usage, size, keep=content_hash)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path, path)
+                else:
+                    os.remove(temp_path)
+                with self._lock:
+                    self._entries[content_hash] = None
+                    self._entries.move_to_end(content_hash)
+                    self._touched[content_hash] = time.time()
+                    self._urls[source_url] = content_hash
+                self._evict(usage, keep=content_hash)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        # Called even if another worker wrote the file, so this process knows its derivatives too
+        if self.on_store:
+            self.on_store(content_hash)
+        return self._public_url(content_hash)
+
+    def put_derivative(self, content_hash, temp_path, name):
+        """Move a rendered derivative of a stored image into place under ``name``, within the quota"""
+        path = os.path.join(self.directory, name)
+        try:
+            with self._locked_usage() as usage:
+                if not os.path.exists(self._path(content_hash)):
+                    raise FileNotFoundError(f"Image {content_hash} is no longer stored")
+                try:
+                    replaced = os.path.getsize(path)
+                except OSError:
+                    replaced = 0
+                size = os.path.getsize(temp_path) - replaced
+                self._reserve(usage, size, keep=content_hash)
+                os.replace(temp_path, path)
+                self._evict(usage, keep=content_hash)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def _rescan_due(self):
+        return self._last_rescan is None or time.monotonic() - self._last_rescan > self.rescan_interval
+
+    def _reserve(self, usage, size, keep=None):
+        """Evict until size more bytes fit under the hard quota and count them, or raise StorageQuotaExceeded"""
+        if self.quota_bytes is not None and usage.bytes + size > self.quota_bytes:
+            self._evict(usage, keep=keep, limit=self.quota_bytes - size)
+            if usage.bytes + size > self.quota_bytes and self._rescan_due():
+                # Other workers' images aren't in our LRU yet; recount the disk and try again
+                self._rescan(usage)
+                self._evict(usage, keep=keep, limit=self.quota_bytes - size)
+            if usage.bytes + size > self.quota_bytes:
+                with self._lock:
+                    self.rejections += 1
+                raise StorageQuotaExceeded(
+                    f"Storing {size} bytes would exceed the image quota of {self.quota_bytes} bytes"
+                )
+        usage.bytes += size
+
+    def _evict(self, usage, keep=None, limit=None):
+        """Drop least recently used unpinned images until usage fits the byte budget"""
+        if limit is None:
+            limit = self.max_bytes
+        if usage.bytes <= limit:
+            return
+        pinned = self.pinned() if self.pinned else ()
+
+        with self._lock:
+            candidates = list(self._entries)
+        for content_hash in candidates:
+            if usage.bytes <= limit:
+                break
+            if content_hash == keep or content_hash in pinned:
+                continue
+            self._drop(usage, content_hash)
+
+    def _drop(self, usage, content_hash):
+        """Delete an image and all of its derivatives; called with the usage lock held"""
+        directory = os.path.join(self.directory, shard(content_hash))
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+        removed = 0
+        for name in names:
+            match = self.SHARD_FILE_PATTERN.match(name)
+            if not match or match.group(1) != content_hash:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                # Only bytes we actually removed count; another worker may have got there first
+                usage.bytes -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error evicting cached image {name}: {e}")
+
+        if removed:
+            with self._lock:
+                self.evictions += 1
+        self._forget(content_hash)
+
+    def _forget(self, content_hash):
+        """Drop an image whose files are gone from the index, and tell on_evict"""
+        with self._lock:
+            self._entries.pop(content_hash, None)
+            self._touched.pop(content_hash, None)
+            for url in [u for u, h in self._urls.items() if h == content_hash]:
+                del self._urls[url]
+        if self.on_evict:
+            self.on_evict(content_hash)
+
+    def remove(self, content_hash):
+        """Delete a stored image and its derivatives; return 1 if it existed"""
+        with self._locked_usage() as usage:
+            with self._lock:
+                if content_hash not in self._entries:
+                    return 0
+            self._drop(usage, content_hash)
+            return 1
+
+    def stats(self):
+        """Return cache counters and usage"""
+        # Read without the lock, so a long eviction or rescan doesn't hold up health checks
+        used = self._usage.peek()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'rejections': self.rejections,
+                'entries': len(self._entries),
+                'urls': len(self._urls),
+                'bytes': used,
+                'max_bytes': self.max_bytes,
+                'quota_bytes': self.quota_bytes
+            }
@@ -0,0 +1,229 @@
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, features
+
+from image_storage import image_hash, shard
+
+# Pillow format name and encoder options for each derivative extension
+DERIVATIVE_FORMATS = {
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'avif': ('AVIF', {'quality': 60})
+}
+
+DERIVATIVE_PATTERN = re.compile(r'^([0-9a-f]{64})_(\d+)w\.(jpg|webp|avif)$')
+SOURCE_PATTERN = re.compile(r'^([0-9a-f]{64})\.jpg$')
+
+def derivative_name(content_hash, width, ext):
+    return f"{shard(content_hash)}/{content_hash}_{width}w.{ext}"
+
+def source_width(source_path):
+    """Pixel width of a stored image, read from its header"""
+    with Image.open(source_path) as img:
+        return img.width
+
+def render_derivatives(source_path, directory, content_hash, widths, formats, store=None):
+    """Write resized copies of an image and return (source width, {ext: {width: filename}}).
+
+    Names are relative to directory. Copies already on disk (rendered by another
+    worker) are only recorded. Each new copy is encoded to a temp file first;
+    ``store(content_hash, temp_path, name)``, if given, moves it into place (and
+    may refuse it by raising), otherwise it is simply renamed.
+    """
+    results = {}
+    with Image.open(source_path) as img:
+        original_width = img.width
+        missing = {}
+        for width in sorted(widths):
+            if width >= original_width:
+                continue
+            for ext in formats:
+                name = derivative_name(content_hash, width, ext)
+                if os.path.exists(os.path.join(directory, name)):
+                    results.setdefault(ext, {})[width] = name
+                else:
+                    missing.setdefault(width, []).append(ext)
+        if not missing:
+            return original_width, results
+
+        # Let the JPEG decoder skip detail we are about to throw away
+        img.draft('RGB', (max(widths), max(widths)))
+        img = img.convert('RGB')
+
+        for width, exts in missing.items():
+            resized = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+            for ext in exts:
+                pil_format, options = DERIVATIVE_FORMATS[ext]
+                name = derivative_name(content_hash, width, ext)
+                temp_path = os.path.join(directory, shard(content_hash), f".{uuid.uuid4().hex}.tmp")
+                resized.save(temp_path, format=pil_format, **options)
+                if store is None:
+                    os.replace(temp_path, os.path.join(directory, name))
+                else:
+                    store(content_hash, temp_path, name)
+                results.setdefault(ext, {})[width] = name
+    return original_width, results
+
+class DerivativeGenerator:
+    """Produces fixed-width JPEG/WebP copies of stored images in a worker pool.
+
+    Pillow releases the GIL while resizing and encoding, so a thread pool
+    gives real parallelism without forking the web process. Finished
+    derivatives are tracked in memory so building a srcset map never
+    touches the disk. ``store``, if set, moves each rendered file into place
+    (see render_derivatives), so the image cache can reserve its bytes
+    against the quota first and refuse it when there is no room.
+    """
+
+    def __init__(self, directory='static', url_prefix='/static', widths=(320, 640, 1024),
+                 formats=('jpg', 'webp'), workers=2, store=None):
+        self.directory = directory
+        self.store = store
+        self.url_prefix = url_prefix
+        self.widths = tuple(widths)
+        self.formats = tuple(ext for ext in formats if ext != 'avif' or features.check('avif'))
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-derivatives')
+
+        self._lock = threading.Lock()
+        self._derivatives = {}  # content_hash -> {ext: {width: filename}}
+        self._source_widths = {}  # content_hash -> width of the stored original
+        self._scheduled = set()
+        # While paused (in a parent process about to fork) work is queued instead of started
+        self._paused = False
+        self._pending = []
+
+    def scan(self):
+        """Register derivatives already on disk and schedule any that are missing"""
+        sources = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                match = DERIVATIVE_PATTERN.match(name)
+                if match:
+                    content_hash, width, ext = match.group(1), int(match.group(2)), match.group(3)
+                    path = os.path.join(root, name)
+                    if os.path.basename(root) != shard(content_hash):
+                        # Written before images were sharded; move it next to its source
+                        os.makedirs(os.path.join(self.directory, shard(content_hash)), exist_ok=True)
+                        os.replace(path, os.path.join(self.directory, derivative_name(content_hash, width, ext)))
+                    with self._lock:
+                        self._derivatives.setdefault(content_hash, {}).setdefault(ext, {})[width] = \
+                            derivative_name(content_hash, width, ext)
+                elif SOURCE_PATTERN.match(name):
+                    sources.append(name[:-4])
+
+        for content_hash in sources:
+            with self._lock:
+                done = content_hash in self._derivatives
+            if not done:
+                self.schedule(content_hash)
+                continue
+            try:
+                width = source_width(self._render_args(content_hash)[0])
+            except Exception as e:
+                print(f"Error reading stored image {content_hash}: {e}")
+                continue
+            with self._lock:
+                self._scheduled.add(content_hash)
+                self._source_widths[content_hash] = width
+
+    def schedule(self, content_hash):
+        """Queue derivative generation for a newly stored image"""
+        with self._lock:
+            if content_hash in self._scheduled:
+                return None
+            self._scheduled.add(content_hash)
+            if self._paused:
+                self._pending.append(content_hash)
+                return None
+        return self._submit(content_hash)
+
+    def _render_args(self, content_hash):
+        source_path = os.path.join(self.directory, shard(content_hash), f"{content_hash}.jpg")
+        return source_path, self.directory, content_hash, self.widths, self.formats, self.store
+
+    def _submit(self, content_hash):
+        future = self.pool.submit(render_derivatives, *self._render_args(content_hash))
+        future.add_done_callback(lambda f: self._finished(content_hash, f))
+        return future
+
+    def pause(self):
+        """Queue new work without starting pool threads, which would not survive a fork"""
+        with self._lock:
+            self._paused = True
+
+    def flush(self):
+        """Render all queued work now, on one thread per core that is gone again on return"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        with ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix='image-derivatives-flush') as pool:
+            futures = [(h, pool.submit(render_derivatives, *self._render_args(h))) for h in pending]
+        for content_hash, future in futures:
+            self._finished(content_hash, future)
+
+    def resume(self):
+        """Start rendering in the pool again, beginning with anything still queued"""
+        with self._lock:
+            self._paused = False
+            pending, self._pending = self._pending, []
+        for content_hash in pending:
+            self._submit(content_hash)
+
+    def _finished(self, content_hash, future):
+        try:
+            width, results = future.result()
+        except Exception as e:
+            print(f"Error creating derivatives for {content_hash}: {e}")
+            with self._lock:
+                self._scheduled.discard(content_hash)
+            return
+        with self._lock:
+            evicted = content_hash not in self._scheduled
+            if not evicted:
+                self._derivatives[content_hash] = results
+                self._source_widths[content_hash] = width
+        if evicted:
+            # The source was evicted while we were rendering
+            self._delete(results)
+
+    def remove(self, content_hash):
+        """Forget the derivatives of an evicted image; the image cache deletes their files"""
+        with self._lock:
+            self._scheduled.discard(content_hash)
+            self._derivatives.pop(content_hash, None)
+            self._source_widths.pop(content_hash, None)
+
+    def _delete(self, derivatives):
+        for files in derivatives.values():
+            for name in files.values():
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def srcset(self, image_url):
+        """Return {ext: {'320w': url, ...}} for one of our stored images, or {} until it is rendered.
+
+        Every format also lists the original at its own width, as the largest
+        candidate; it is a JPEG, but a <picture> source accepts any type.
+        """
+        content_hash = image_hash(image_url, self.url_prefix)
+        if content_hash is None or not image_url.endswith(f"{content_hash}.jpg"):
+            return {}
+
+        with self._lock:
+            derivatives = self._derivatives.get(content_hash, {})
+            original_width = self._source_widths.get(content_hash)
+            srcset = {
+                ext: {f"{width}w": f"{self.url_prefix}/{name}" for width, name in sorted(files.items())}
+                for ext, files in derivatives.items()
+            }
+        if original_width is not None:
+            for ext in dict.fromkeys(self.formats + tuple(srcset)):
+                srcset.setdefault(ext, {})[f"{original_width}w"] = image_url
+        return srcset
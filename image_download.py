@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import os
+import uuid
+
+from PIL import Image, ImageFile
+
+import metrics
+
+# Leading bytes of the image formats we accept, checked before anything is written
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'RIFF', 'WEBP')  # followed by the size and b'WEBP'
+)
+
+# Content types some CDNs send for images; anything else non-image is refused
+GENERIC_CONTENT_TYPES = ('application/octet-stream', 'binary/octet-stream')
+
+class ImageDownloadError(ValueError):
+    """Raised when a response isn't an image we are willing to store"""
+
+def sniff_image_format(head):
+    """Return the Pillow format name for the first bytes of a file, or None"""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            if image_format == 'WEBP' and head[8:12] != b'WEBP':
+                return None
+            return image_format
+    return None
+
+class StreamingImageFile:
+    """One image being streamed into a temporary file.
+
+    Each chunk is size-checked, hashed and written as it arrives, so memory
+    use is bounded by the chunk size. The first bytes are checked against
+    known image signatures and fed to Pillow's incremental parser until it
+    has read the image header, which yields the format and dimensions
+    before the rest of the body is downloaded.
+    """
+
+    # Give up if Pillow can't find the image size within this many bytes
+    HEADER_LIMIT = 512 * 1024
+
+    def __init__(self, temp_path, max_bytes):
+        self.temp_path = temp_path
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.format = None
+        self.dimensions = None
+
+        self._digest = hashlib.sha256()
+        self._head = b''
+        self._parser = ImageFile.Parser()
+        self._file = open(temp_path, 'wb')
+
+    def write(self, chunk):
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise ImageDownloadError(f"Image is larger than {self.max_bytes} bytes")
+
+        if self.format is None:
+            self._head += chunk[:16]
+            if len(self._head) >= 16:
+                self.format = sniff_image_format(self._head)
+                if self.format is None:
+                    raise ImageDownloadError("Response is not a supported image")
+
+        if self._parser is not None:
+            try:
+                self._parser.feed(chunk)
+            except Exception as e:
+                raise ImageDownloadError(f"Image header can't be decoded: {e}")
+            if self._parser.image is not None:
+                self.dimensions = self._parser.image.size
+                # Decompression bombs are refused before their body is downloaded
+                if Image.MAX_IMAGE_PIXELS and self.dimensions[0] * self.dimensions[1] > Image.MAX_IMAGE_PIXELS:
+                    raise ImageDownloadError(f"Image dimensions {self.dimensions} are too large")
+                self._parser = None
+            elif self.size > self.HEADER_LIMIT:
+                raise ImageDownloadError("Image header can't be decoded")
+
+        self._digest.update(chunk)
+        self._file.write(chunk)
+
+    def close(self):
+        """Finish writing and return the SHA-256 of everything written"""
+        self._file.close()
+        if self.dimensions is None:
+            raise ImageDownloadError("Response ended before a complete image header")
+        return self._digest.hexdigest()
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+class ImageDownloader:
+    """Streams image responses into the image cache.
+
+    Bodies go chunk by chunk into a temporary file beside the cache and are
+    renamed into place once complete, so neither a whole image nor a partial
+    file is ever visible. Anything that isn't JPEG, and with
+    ``max_dimension`` set any larger JPEG, is re-encoded to a JPEG that fits
+    (stored images are always ``.jpg``); JPEGs are decoded at reduced scale
+    with Pillow's draft mode for that.
+    """
+
+    def __init__(self, image_cache, max_bytes=20 * 1024 * 1024, chunk_size=64 * 1024, max_dimension=None,
+                 quality=85):
+        self.image_cache = image_cache
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.max_dimension = max_dimension
+        self.quality = quality
+
+    def _temp_path(self):
+        return os.path.join(self.image_cache.directory, f".{uuid.uuid4().hex}.tmp")
+
+    def begin(self, headers):
+        """Check a response's headers and return a StreamingImageFile for its body"""
+        content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type and not content_type.startswith('image/') and content_type not in GENERIC_CONTENT_TYPES:
+            raise ImageDownloadError(f"Unexpected content type: {content_type}")
+        content_length = headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise ImageDownloadError(f"Image is larger than {self.max_bytes} bytes")
+        return StreamingImageFile(self._temp_path(), self.max_bytes)
+
+    def _needs_reencode(self, download):
+        if download.format != 'JPEG':
+            return True
+        return bool(self.max_dimension) and max(download.dimensions) > self.max_dimension
+
+    def _reencode(self, download):
+        """Write a JPEG copy of the download that fits max_dimension; return (path, hash, size)"""
+        target = self.max_dimension or max(download.dimensions)
+        temp_path = self._temp_path()
+        try:
+            with Image.open(download.temp_path) as img:
+                # Let the JPEG decoder skip detail we are about to throw away
+                img.draft('RGB', (target, target))
+                img = img.convert('RGB')
+                img.thumbnail((target, target), Image.LANCZOS)
+                img.save(temp_path, format='JPEG', quality=self.quality, optimize=True)
+
+            digest = hashlib.sha256()
+            with open(temp_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    digest.update(chunk)
+            return temp_path, digest.hexdigest(), os.path.getsize(temp_path)
+        except Exception:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        finally:
+            download.discard()
+
+    def finish(self, source_url, download):
+        """Move a completely written download into the cache and return its local URL"""
+        content_hash = download.close()
+        temp_path, size = download.temp_path, download.size
+        if self._needs_reencode(download):
+            temp_path, content_hash, size = self._reencode(download)
+        with metrics.span('image_disk_write'):
+            return self.image_cache.put_file(source_url, temp_path, content_hash, size)
+
+    def read(self, response):
+        """Stream a requests response through the same checks as store() and return its bytes, without storing it"""
+        download = self.begin(response.headers)
+        try:
+            for chunk in response.iter_content(self.chunk_size):
+                download.write(chunk)
+            download.close()
+            with open(download.temp_path, 'rb') as f:
+                return f.read()
+        finally:
+            download.discard()
+
+    def store(self, source_url, response):
+        """Stream a requests response (fetched with stream=True) into the cache"""
+        download = self.begin(response.headers)
+        try:
+            for chunk in response.iter_content(self.chunk_size):
+                download.write(chunk)
+            return self.finish(source_url, download)
+        except BaseException:
+            download.discard()
+            raise
+
+    async def store_async(self, source_url, response):
+        """Stream an httpx response (sent with stream=True) into the cache, writing off the event loop"""
+        download = self.begin(response.headers)
+        try:
+            async for chunk in response.aiter_bytes(self.chunk_size):
+                await asyncio.to_thread(download.write, chunk)
+            return await asyncio.to_thread(self.finish, source_url, download)
+        except BaseException:
+            download.discard()
+            raise
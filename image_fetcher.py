@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class CircuitOpenError(Exception):
+    """Raised when a host's circuit breaker is rejecting requests"""
+
+class CircuitBreaker:
+    """Stops calling an upstream host after repeated failures.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    rejects calls for ``reset_timeout`` seconds, then lets one trial request
+    through to decide whether to close again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def allow(self):
+        """Return True if a request may be sent now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            # Half-open: let a single request probe the upstream
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+class _HostBreakers:
+    """Keeps one circuit breaker per upstream host"""
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+
+    def _breaker(self, url):
+        host = urlsplit(url).netloc
+        with self._breakers_lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[host] = breaker
+            return breaker
+
+class ImageFetcher(_HostBreakers):
+    """Shared HTTP layer for every outbound image download.
+
+    Uses one pooled keep-alive session with connect/read timeouts, retries
+    idempotent GETs with exponential backoff and keeps a circuit breaker per
+    upstream host.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10, retries=2,
+                 backoff_factor=0.3, failure_threshold=5, reset_timeout=30):
+        super().__init__(failure_threshold, reset_timeout)
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, stream=False):
+        """GET a URL through the shared session, honouring the host's circuit breaker.
+
+        With stream=True the body is left unread; close the response when done.
+        """
+        breaker = self._breaker(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Upstream {urlsplit(url).netloc} is unavailable")
+
+        try:
+            response = self.session.get(url, timeout=self.timeout, stream=stream)
+        except requests.RequestException:
+            breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+class AsyncImageFetcher(_HostBreakers):
+    """Non-blocking counterpart of ImageFetcher for the asyncio serving mode.
+
+    Call ``start()`` from inside the running event loop before the first
+    request and ``close()`` on shutdown.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10, retries=2,
+                 backoff_factor=0.3, failure_threshold=5, reset_timeout=30):
+        super().__init__(failure_threshold, reset_timeout)
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.client = None
+
+    async def start(self):
+        self.client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get(self, url, stream=False):
+        """GET a URL without blocking the event loop, honouring the host's circuit breaker.
+
+        With stream=True the body is left unread; ``aclose()`` the response when done.
+        """
+        breaker = self._breaker(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Upstream {urlsplit(url).netloc} is unavailable")
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.send(self.client.build_request('GET', url), stream=stream)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    breaker.record_failure()
+                    raise
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt == self.retries:
+                    break
+                await response.aclose()
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
@@ -1,8 +1,33 @@
+import json
+import os
 import random
 import re
+import threading
+from urllib.parse import urlsplit
+
+DEFAULT_KEYWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'image_keywords.json')
 
 class ImageSelector:
-    def __init__(self):
+    # Story-type keywords for each image collection, in priority order
+    CATEGORY_KEYWORDS = {
+        'robot': ['robot', 'android', 'machine', 'cyborg'],
+        'door': ['door', 'gate', 'entrance', 'portal'],
+        'adventure': ['adventure', 'journey', 'quest', 'explore'],
+        'scifi': ['space', 'alien', 'future', 'technology'],
+        'mystery': ['mystery', 'secret', 'hidden', 'clue'],
+        'romance': ['love', 'romance', 'heart', 'relationship'],
+        'horror': ['scary', 'horror', 'fear', 'dark']
+    }
+    
+    # Collections to fall back on for each scene role, after keywords and genre
+    SCENE_COLLECTIONS = {
+        'introduction': ['nature', 'adventure'],
+        'conflict': ['mystery', 'horror'],
+        'climax': ['adventure', 'scifi'],
+        'resolution': ['nature', 'romance']
+    }
+    
+    def __init__(self, keywords_path=None, seed=None, base_url=None):
         # Diverse image collections for different story types and scenes
         self.image_collections = {
             # Robot/Sci-fi images
@@ -94,32 +119,110 @@ class ImageSelector:
             'climax': ['peak', 'final', 'ultimate', 'showdown', 'battle', 'crisis'],
             'resolution': ['end', 'conclusion', 'solution', 'victory', 'peace', 'happy']
         }
+        
+        # Keyword table, optionally extended from a JSON file
+        self.category_keywords = {category: list(words) for category, words in self.CATEGORY_KEYWORDS.items()}
+        configured_path = keywords_path or os.environ.get('IMAGE_KEYWORDS_PATH')
+        keywords_path = configured_path or DEFAULT_KEYWORDS_PATH
+        if os.path.exists(keywords_path):
+            self.load_keywords(keywords_path)
+        elif configured_path:
+            # The default file is optional; only a path someone asked for is worth reporting
+            print(f"No image keywords file at {keywords_path}, using the built-in keywords")
+        
+        self.compile_keywords()
+        
+        # Serve the same image paths from another host, e.g. a local stand-in for benchmarks
+        if base_url is None:
+            base_url = os.environ.get('IMAGE_BASE_URL')
+        if base_url:
+            self.image_collections = {
+                category: [self.rebase_url(url, base_url) for url in urls]
+                for category, urls in self.image_collections.items()
+            }
+        
+        # Collections become immutable tuples so concurrent requests can share them safely
+        self.image_collections = {
+            category: tuple(dict.fromkeys(urls)) for category, urls in self.image_collections.items()
+        }
+        self.all_images = tuple(dict.fromkeys(url for urls in self.image_collections.values() for url in urls))
+        
+        # With a seed, selections keyed by story/prompt are deterministic; otherwise each
+        # thread draws from its own RNG
+        if seed is None and os.environ.get('IMAGE_SELECTION_SEED'):
+            seed = os.environ['IMAGE_SELECTION_SEED']
+        self.seed = seed
+        self._local = threading.local()
+    
+    def load_keywords(self, path):
+        """Extend the keyword table (and image collections) from a JSON file.
+        
+        The file looks like {"keywords": {"dragon": ["dragon", "wyvern"]},
+        "collections": {"dragon": ["https://..."]}}; new categories are
+        matched after the built-in ones.
+        """
+        with open(path, encoding='utf-8') as f:
+            table = json.load(f)
+        
+        for category, urls in table.get('collections', {}).items():
+            existing = list(self.image_collections.get(category, ()))
+            self.image_collections[category] = existing + [u for u in urls if u not in existing]
+        for category, words in table.get('keywords', {}).items():
+            self.category_keywords.setdefault(category, [])
+            self.category_keywords[category].extend(w.lower() for w in words if w.lower() not in self.category_keywords[category])
+    
+    def compile_keywords(self):
+        """Build the single-pass keyword matcher from the keyword table"""
+        self.keyword_categories = {}
+        for category, words in self.category_keywords.items():
+            for word in words:
+                self.keyword_categories.setdefault(word, category)
+        self.category_priority = {category: i for i, category in enumerate(self.category_keywords)}
+        self.keyword_pattern = self._compile_words(self.keyword_categories)
+        
+        self.scene_keyword_roles = {}
+        for role, words in self.scene_keywords.items():
+            for word in words:
+                self.scene_keyword_roles.setdefault(word, role)
+        self.scene_keyword_pattern = self._compile_words(self.scene_keyword_roles)
+    
+    @staticmethod
+    def rebase_url(url, base_url):
+        """Move an image URL's path (and query) onto another origin"""
+        parts = urlsplit(url)
+        return base_url.rstrip('/') + parts.path + (f"?{parts.query}" if parts.query else '')
+    
+    def _rng(self, key=None):
+        """Return a deterministic RNG for key in seeded mode, else this thread's RNG"""
+        if self.seed is not None and key is not None:
+            return random.Random(f"{self.seed}:{key}")
+        rng = getattr(self._local, 'rng', None)
+        if rng is None:
+            rng = random.Random()
+            self._local.rng = rng
+        return rng
+    
+    @staticmethod
+    def _compile_words(words):
+        """Match whole words only (plus simple plurals), longest alternatives first"""
+        words = sorted(words, key=len, reverse=True)
+        return re.compile(r'\b(' + '|'.join(re.escape(w) for w in words) + r')(?:s|es)?\b')
+    
+    def match_keywords(self, text):
+        """Return [(category, match_count), ...] for the text, in priority order"""
+        counts = {}
+        for word in self.keyword_pattern.findall(text.lower()):
+            category = self.keyword_categories[word]
+            counts[category] = counts.get(category, 0) + 1
+        return sorted(counts.items(), key=lambda item: self.category_priority[item[0]])
     
     def extract_keywords(self, text):
         """Extract relevant keywords from text for image matching"""
-        text_lower = text.lower()
-        keywords = []
-        
-        # Check for story type keywords
-        if any(word in text_lower for word in ['robot', 'android', 'machine', 'cyborg']):
-            keywords.append('robot')
-        if any(word in text_lower for word in ['door', 'gate', 'entrance', 'portal']):
-            keywords.append('door')
-        if any(word in text_lower for word in ['adventure', 'journey', 'quest', 'explore']):
-            keywords.append('adventure')
-        if any(word in text_lower for word in ['space', 'alien', 'future', 'technology']):
-            keywords.append('scifi')
-        if any(word in text_lower for word in ['mystery', 'secret', 'hidden', 'clue']):
-            keywords.append('mystery')
-        if any(word in text_lower for word in ['love', 'romance', 'heart', 'relationship']):
-            keywords.append('romance')
-        if any(word in text_lower for word in ['scary', 'horror', 'fear', 'dark']):
-            keywords.append('horror')
-            
-        return keywords
+        return [category for category, _ in self.match_keywords(text)]
     
-    def get_scene_specific_image(self, image_prompt, story_genre=None, scene_type=None):
+    def get_scene_specific_image(self, image_prompt, story_genre=None, scene_type=None, key=None):
         """Get a relevant image based on the prompt, genre, and scene type"""
+        rng = self._rng(key)
         try:
             # Extract keywords from the image prompt
             keywords = self.extract_keywords(image_prompt)
@@ -136,35 +239,107 @@ class ImageSelector:
             
             # If no specific keywords found, try story genre
             if image_collection == 'default' and story_genre:
-                genre_lower = story_genre.lower()
-                if 'sci' in genre_lower or 'robot' in genre_lower:
-                    image_collection = 'robot'
-                elif 'mystery' in genre_lower or 'thriller' in genre_lower:
-                    image_collection = 'mystery'
-                elif 'adventure' in genre_lower or 'fantasy' in genre_lower:
-                    image_collection = 'adventure'
-                elif 'romance' in genre_lower:
-                    image_collection = 'romance'
-                elif 'horror' in genre_lower:
-                    image_collection = 'horror'
+                image_collection = self.genre_collection(story_genre) or 'default'
+            
+            # Then the scene type
+            if image_collection == 'default' and scene_type in self.SCENE_COLLECTIONS:
+                image_collection = self.SCENE_COLLECTIONS[scene_type][0]
             
             # Get images from the selected collection
             available_images = self.image_collections.get(image_collection, self.image_collections['default'])
             
-            # Add some randomness to ensure variety
-            random.shuffle(available_images)
-            
             # Return a random image from the collection
-            return random.choice(available_images)
+            return rng.choice(available_images)
             
         except Exception as e:
             print(f"Error in get_scene_specific_image: {e}")
             # Fallback to default image
-            return random.choice(self.image_collections['default'])
+            return rng.choice(self.image_collections['default'])
+    
+    def genre_collection(self, story_genre):
+        """Return the image collection for a story genre, or None"""
+        if not story_genre:
+            return None
+        genre_lower = story_genre.lower()
+        if 'sci' in genre_lower or 'robot' in genre_lower:
+            return 'robot'
+        elif 'mystery' in genre_lower or 'thriller' in genre_lower:
+            return 'mystery'
+        elif 'adventure' in genre_lower or 'fantasy' in genre_lower:
+            return 'adventure'
+        elif 'romance' in genre_lower:
+            return 'romance'
+        elif 'horror' in genre_lower:
+            return 'horror'
+        return None
+    
+    def classify_scene_roles(self, image_prompts):
+        """Classify each prompt as introduction/conflict/climax/resolution.
+        
+        Uses the scene keywords where they match, otherwise the scene's
+        position in the story.
+        """
+        roles = []
+        count = len(image_prompts)
+        for index, prompt in enumerate(image_prompts):
+            counts = {}
+            for word in self.scene_keyword_pattern.findall(prompt.lower()):
+                role = self.scene_keyword_roles[word]
+                counts[role] = counts.get(role, 0) + 1
+            
+            if counts:
+                roles.append(max(counts, key=counts.get))
+            elif index == 0:
+                roles.append('introduction')
+            elif index == count - 1:
+                roles.append('resolution')
+            elif index == count - 2:
+                roles.append('climax')
+            else:
+                roles.append('conflict')
+        return roles
+    
+    def select_story_images(self, image_prompts, story_genre=None, story_key=None):
+        """Pick one image per scene prompt for a whole story, without repeats.
+        
+        Each scene tries its keyword collections, then the genre collection,
+        then the collections for its scene role, skipping images already used
+        by earlier scenes. Repeats only happen once every image is taken.
+        In seeded mode the same story (story_key, or the prompts and genre)
+        always gets the same images.
+        """
+        if story_key is None:
+            story_key = '\n'.join(image_prompts) + f"\n{story_genre}"
+        rng = self._rng(story_key)
+        genre_collection = self.genre_collection(story_genre)
+        roles = self.classify_scene_roles(image_prompts)
+        used = set()
+        selected = []
+        
+        for prompt, role in zip(image_prompts, roles):
+            preferences = self.extract_keywords(prompt)
+            if genre_collection:
+                preferences.append(genre_collection)
+            preferences.extend(self.SCENE_COLLECTIONS.get(role, []))
+            preferences.append('default')
+            
+            image = None
+            for collection in dict.fromkeys(preferences):
+                candidates = [url for url in self.image_collections.get(collection, ()) if url not in used]
+                if candidates:
+                    image = rng.choice(candidates)
+                    break
+            
+            if image is None:
+                # Every preferred image is taken - use any unused image, then allow repeats
+                candidates = [url for url in self.all_images if url not in used]
+                image = rng.choice(candidates or self.all_images)
+            
+            used.add(image)
+            selected.append(image)
+        
+        return selected
     
-    def get_demo_image(self):
+    def get_demo_image(self, key=None):
         """Get a random demo image"""
-        all_images = []
-        for collection in self.image_collections.values():
-            all_images.extend(collection)
-        return random.choice(all_images)
+        return self._rng(key).choice(self.all_images)
@@ -0,0 +1,281 @@
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from story_store import thread_connection
+
+try:
+    import fcntl
+except ImportError:  # Windows: files are opened but not locked, so only threads are coordinated
+    fcntl = None
+
+# /static/<shard>/<sha256>.jpg, /static/<shard>/<sha256>_<width>w.<ext>, or the older unsharded form
+IMAGE_URL_PATTERN = re.compile(r'^(?:[0-9a-f]{2}/)?([0-9a-f]{64})(?:_\d+w)?\.(?:jpg|webp|avif)$')
+CONTENT_ADDRESSED_NAME = re.compile(r'^([0-9a-f]{64})(?:_\d+w)?\.(?:jpg|webp|avif)$')
+# Images saved as static/<uuid>.jpg before the cache was content-addressed
+LEGACY_IMAGE_NAME = re.compile(r'^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\.jpg$')
+
+def shard(content_hash):
+    """Subdirectory for a content hash, so no directory holds more than 1/256 of the files"""
+    return content_hash[:2]
+
+def sharded_name(filename):
+    """Map a content-addressed file name to its path relative to the image directory"""
+    match = CONTENT_ADDRESSED_NAME.match(filename)
+    return f"{shard(match.group(1))}/{filename}" if match else filename
+
+@contextmanager
+def locked_file(path, blocking=True):
+    """Open a small state file for reading and rewriting under an exclusive flock held until the block exits.
+
+    Yields None instead of the file if blocking is False and another process holds the lock.
+    """
+    with open(path, 'a+') as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield None
+                return
+        f.seek(0)
+        yield f
+
+def image_hash(image_url, url_prefix='/static'):
+    """Return the content hash behind one of our image URLs, or None"""
+    if not image_url or not image_url.startswith(url_prefix + '/'):
+        return None
+    match = IMAGE_URL_PATTERN.match(image_url[len(url_prefix) + 1:])
+    return match.group(1) if match else None
+
+def image_key(image_url, url_prefix='/static'):
+    """Return the key references use for one of our image URLs (content hash or legacy uuid), or None"""
+    content_hash = image_hash(image_url, url_prefix)
+    if content_hash is not None or not image_url or not image_url.startswith(url_prefix + '/'):
+        return content_hash
+    match = LEGACY_IMAGE_NAME.match(image_url[len(url_prefix) + 1:])
+    return match.group(1) if match else None
+
+def story_image_keys(story_data, url_prefix='/static'):
+    """Reference keys of every locally stored image a story points at"""
+    keys = set()
+    for scene in story_data.get('scenes', []):
+        key = image_key(scene.get('image_url'), url_prefix)
+        if key:
+            keys.add(key)
+    return keys
+
+def create_image_references(backend='sqlite', path='shared_stories.db'):
+    """Build the image reference registry matching the story store backend"""
+    if backend == 'memory':
+        return MemoryImageReferences()
+    if backend != 'sqlite':
+        raise ValueError(f"Unknown image reference backend: {backend}")
+    return SQLiteImageReferences(path)
+
+class MemoryImageReferences:
+    """Process-local registry of which stored images are still in use, and until when.
+
+    Images are identified by content hash (or, for files saved before
+    images were content-addressed, the uuid in their name).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refs = {}  # content_hash -> {owner: expires_at}
+        # True if nothing was recorded before this process started
+        self.created = True
+
+    def add(self, owner, content_hashes, expires_at=None):
+        """Record that owner (e.g. "share:<id>") uses these images until expires_at"""
+        with self._lock:
+            for content_hash in content_hashes:
+                self._refs.setdefault(content_hash, {})[owner] = expires_at
+
+    def referenced_hashes(self):
+        """Return the set of image keys with at least one unexpired reference"""
+        now = time.time()
+        with self._lock:
+            return {
+                content_hash for content_hash, owners in self._refs.items()
+                if any(expires_at is None or expires_at > now for expires_at in owners.values())
+            }
+
+    def purge_expired(self):
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for content_hash in list(self._refs):
+                owners = self._refs[content_hash]
+                for owner in [o for o, expires_at in owners.items() if expires_at is not None and expires_at <= now]:
+                    del owners[owner]
+                    removed += 1
+                if not owners:
+                    del self._refs[content_hash]
+        return removed
+
+class SQLiteImageReferences(MemoryImageReferences):
+    """Image reference registry shared by every worker process on the host.
+
+    Kept next to the shared stories (same database file by default) so a
+    share and the images it pins are backed up together.
+    """
+
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS image_refs (
+            content_hash TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            expires_at REAL,
+            PRIMARY KEY (content_hash, owner)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_image_refs_expires_at ON image_refs (expires_at)'
+    ]
+
+    def __init__(self, path='shared_stories.db'):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        with conn:
+            self.created = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_refs'"
+            ).fetchone() is None
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _connection(self):
+        return thread_connection(self._local, self.path)
+
+    def add(self, owner, content_hashes, expires_at=None):
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO image_refs (content_hash, owner, expires_at) VALUES (?, ?, ?)',
+                [(content_hash, owner, expires_at) for content_hash in content_hashes]
+            )
+
+    def referenced_hashes(self):
+        rows = self._connection().execute(
+            'SELECT DISTINCT content_hash FROM image_refs WHERE expires_at IS NULL OR expires_at > ?', (time.time(),)
+        )
+        return {row[0] for row in rows}
+
+    def purge_expired(self):
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                'DELETE FROM image_refs WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),)
+            )
+        return cursor.rowcount
+
+class StorageSweeper:
+    """Background thread that deletes stored images nobody uses any more.
+
+    An image is removed once it has no unexpired reference (shares pin the
+    images they show) and its file hasn't been written or served from the
+    cache for ``ttl`` seconds. Images this process's cache doesn't track
+    (another worker's, orphaned derivatives, ``<uuid>.jpg`` files from older
+    releases) follow the same rule; abandoned temp files go after
+    ``temp_ttl``.
+
+    Every worker process runs a sweeper, but they share a lock file that
+    records the last sweep, so the directory is walked once per interval
+    per host rather than once per worker.
+    """
+
+    def __init__(self, image_cache, references, ttl=7 * 24 * 3600, interval=3600, temp_ttl=3600, lock_path=None):
+        self.image_cache = image_cache
+        self.references = references
+        self.ttl = ttl
+        self.interval = interval
+        self.temp_ttl = temp_ttl
+        self.lock_path = lock_path or os.path.join(image_cache.directory, '.sweep.lock')
+
+        self._stop = threading.Event()
+        self._thread = None
+        self.sweeps = 0
+        self.removed = 0
+
+    def start(self):
+        """Start sweeping in a daemon thread (again, after a fork)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='storage-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with self._claim() as claimed:
+                    if claimed:
+                        self.sweep()
+            except Exception as e:
+                print(f"Error sweeping image storage: {e}")
+
+    @contextmanager
+    def _claim(self):
+        """Yield True if this process should sweep now, holding the host-wide lock while it does"""
+        with locked_file(self.lock_path, blocking=False) as f:
+            if f is None:
+                yield False  # Another process is sweeping right now
+                return
+            try:
+                last_sweep = float(f.read() or 0)
+            except ValueError:
+                last_sweep = 0
+            if time.time() - last_sweep < self.interval / 2:
+                yield False
+                return
+            yield True
+            f.seek(0)
+            f.truncate()
+            f.write(str(time.time()))
+
+    def sweep(self):
+        """Remove unreferenced images older than the TTL and return how many files went"""
+        self.references.purge_expired()
+        referenced = self.references.referenced_hashes()
+        now = time.time()
+        removed = 0
+
+        for root, _, names in os.walk(self.image_cache.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    age = now - os.stat(path).st_mtime
+                except OSError:
+                    continue
+
+                if name.startswith('.') and name.endswith('.tmp'):
+                    expired = age > self.temp_ttl
+                else:
+                    match = CONTENT_ADDRESSED_NAME.match(name)
+                    if match and self.image_cache.contains(match.group(1)):
+                        # Managed images go through the cache so its accounting and hooks stay right
+                        content_hash = match.group(1)
+                        if name == f"{content_hash}.jpg" and content_hash not in referenced and age > self.ttl:
+                            removed += self.image_cache.remove(content_hash)
+                        continue
+                    if not match:
+                        match = LEGACY_IMAGE_NAME.match(name)
+                    expired = match is not None and age > self.ttl and match.group(1) not in referenced
+
+                if expired:
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError:
+                        pass
+
+        # Files removed above outside the cache (and by crashed writers) no longer count against the quota
+        self.image_cache.rescan()
+        self.sweeps += 1
+        self.removed += removed
+        return removed
+
+    def stats(self):
+        return {'sweeps': self.sweeps, 'removed': self.removed, 'ttl': self.ttl, 'interval': self.interval}
@@ -0,0 +1,105 @@
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter, namedtuple
+
+DEFAULT_INTENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'intents.json')
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# What a question resolved to; intent_id is None for the generic fallback
+IntentMatch = namedtuple('IntentMatch', ['intent_id', 'answer', 'image_prompt', 'score'])
+
+def normalize_token(token):
+    """Fold simple plurals so "stories" and "story" index the same"""
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 4 and token.endswith(('ches', 'shes', 'sses', 'xes')):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+class IntentIndex:
+    """Matches questions to canned answers with a TF-IDF ranked inverted index.
+
+    Each intent's keywords and example questions form its document. At load
+    time every term gets a posting list of (intent, weight) with weights
+    normalized per intent, so a lookup only touches the postings of the
+    question's own terms. Ties go to the intent listed first in the file.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.environ.get('INTENTS_PATH', DEFAULT_INTENTS_PATH)
+        self.load(path)
+
+    def load(self, path):
+        """(Re)load intents from a JSON file (see data/intents.json)"""
+        with open(path, encoding='utf-8') as f:
+            table = json.load(f)
+
+        stopwords = frozenset(normalize_token(word) for word in table.get('stopwords', []))
+        intents = table['intents']
+
+        documents = []
+        for intent in intents:
+            text = ' '.join(intent.get('keywords', []) + intent.get('examples', []))
+            documents.append(Counter(self._tokens(text, stopwords)))
+
+        document_frequency = Counter(term for document in documents for term in document)
+        idf = {term: math.log((1 + len(documents)) / (1 + df)) + 1 for term, df in document_frequency.items()}
+
+        postings = {}
+        for position, document in enumerate(documents):
+            weights = {term: (1 + math.log(count)) * idf[term] for term, count in document.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1
+            for term, weight in weights.items():
+                postings.setdefault(term, []).append((position, weight / norm))
+
+        fallback = table.get('fallback', {})
+        # Swap everything in at once so concurrent lookups see a consistent index
+        self.stopwords = stopwords
+        self.intents = tuple(intents)
+        self.idf = idf
+        self.postings = {term: tuple(entries) for term, entries in postings.items()}
+        self.min_score = table.get('min_score', 0.0)
+        self.fallback_answer = fallback.get('answer', "That's an interesting question about '{question}'.")
+        self.fallback_prompt = fallback.get('image_prompt', 'A creative illustration related to {question}')
+
+    @staticmethod
+    def _tokens(text, stopwords):
+        return [token for token in map(normalize_token, TOKEN_PATTERN.findall(text.lower())) if token not in stopwords]
+
+    def _rank(self, question, limit):
+        query = Counter(self._tokens(question, self.stopwords))
+        scores = {}
+        for term, count in query.items():
+            entries = self.postings.get(term)
+            if not entries:
+                continue
+            query_weight = (1 + math.log(count)) * self.idf[term]
+            for position, weight in entries:
+                scores[position] = scores.get(position, 0.0) + query_weight * weight
+
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def search(self, question, limit=3):
+        """Return up to limit (intent_id, score) pairs, best first"""
+        return [(self.intents[position]['id'], score) for position, score in self._rank(question, limit)]
+
+    def match(self, question):
+        """Return the IntentMatch for a question, falling back to the generic answer"""
+        ranked = self._rank(question, 1)
+        if ranked and ranked[0][1] >= self.min_score:
+            position, score = ranked[0]
+            intent = self.intents[position]
+            return IntentMatch(intent['id'], intent['answer'], intent['image_prompt'], score)
+        return IntentMatch(
+            None,
+            self.fallback_answer.replace('{question}', question),
+            self.fallback_prompt.replace('{question}', question),
+            0.0
+        )
@@ -0,0 +1,177 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from cache hits up to slow downloads and PDF builds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in sorted(items)]
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+
+        samples = []
+        for key, (counts, total, count) in sorted(items):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                samples.append((f"{self.name}_bucket", labels, cumulative))
+            samples.append((f"{self.name}_sum", _format_labels(self.labelnames, key), total))
+            samples.append((f"{self.name}_count", _format_labels(self.labelnames, key), count))
+        return samples
+
+class CallbackMetric:
+    """Gauge or counter whose value is read from a callback when metrics are rendered.
+
+    The callback returns a number, or a {label value tuple: number} dict.
+    Used to expose counters that other components already keep.
+    """
+
+    def __init__(self, name, help, callback, labelnames=(), kind='gauge'):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in sorted(values.items())]
+
+class MetricsRegistry:
+    """Process-local metrics rendered in the Prometheus text format.
+
+    Recording is a dict update under a short lock, cheap enough for every
+    request. Each worker process keeps its own numbers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, callback, labelnames=(), kind='gauge'):
+        return self._register(CallbackMetric(name, help, callback, labelnames, kind))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                print(f"Error collecting metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+# Shared by the app, its worker pools and the PDF job queue
+registry = MetricsRegistry()
+
+span_seconds = registry.histogram(
+    'storyteller_span_seconds', 'Time spent in instrumented sections of request handling', ['span']
+)
+fallbacks_total = registry.counter(
+    'storyteller_image_fallbacks_total', 'Images served from a fallback instead of the local cache', ['reason']
+)
+request_seconds = registry.histogram(
+    'storyteller_request_seconds', 'Time to produce and send a complete response, per route', ['route', 'method', 'status']
+)
+
+@contextmanager
+def span(name):
+    """Time a block into storyteller_span_seconds{span=name}"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        span_seconds.observe(time.perf_counter() - started, span=name)
+
+def fallback(reason):
+    """Count one image fallback"""
+    fallbacks_total.inc(reason=reason)
+
+def stats_callback(stats, keys):
+    """Build a callback exposing stats() counters as {(label,): value}, given {label: stats key}"""
+    return lambda: {(label,): stats()[key] for label, key in keys.items()}
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import metrics
+from pdf_render import render_story_pdf
+from pdf_themes import get_theme
+
+def render_pdf_file(story_data, theme_name, images, output_path):
+    """Render a story PDF to disk; runs inside a worker process"""
+    buffer = render_story_pdf(story_data, get_theme(theme_name), images)
+    temp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(buffer.getvalue())
+    os.replace(temp_path, output_path)
+
+def story_hash(story_data, theme_name):
+    """Hash the canonical JSON of a story and theme"""
+    canonical = json.dumps({'story': story_data, 'theme': theme_name}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def is_job_id(job_id):
+    return len(job_id) == 64 and all(c in '0123456789abcdef' for c in job_id)
+
+class PdfQueueFull(Exception):
+    """Raised when too many PDF jobs are already waiting in this process"""
+
+class PdfJobQueue:
+    """Renders story PDFs in a process pool, off the request path.
+
+    Jobs are identified by a hash of the story JSON and theme, and finished
+    files are kept in ``output_dir`` under that hash, so resubmitting an
+    identical story returns the existing PDF straight away.
+
+    Each job's status, error and download filename are written next to the
+    PDF as ``<job_id>.json``, so any worker process can answer for a job
+    another one is running. Only unfinished jobs are held in memory, at most
+    ``max_pending`` of them. Files older than ``ttl`` seconds are removed
+    every ``cleanup_interval`` seconds, and a job whose status hasn't changed
+    for ``stale_after`` seconds (its worker died) counts as failed.
+    """
+
+    def __init__(self, image_loader, output_dir='pdf_exports', workers=2, max_pending=64, ttl=24 * 3600,
+                 cleanup_interval=600, stale_after=900):
+        self.image_loader = image_loader
+        self.output_dir = output_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self.stale_after = stale_after
+
+        self._lock = threading.Lock()
+        self._jobs = {}  # job_id -> job, queued or running in this process
+        self._processes = None
+        self._last_cleanup = 0
+        # Images are resolved in threads, then layout is handed to the process pool
+        self._dispatcher = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pdf-jobs')
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+    def _process_pool(self):
+        # Started on first use so importing the app doesn't fork workers
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.workers)
+            return self._processes
+
+    def path(self, job_id):
+        return os.path.join(self.output_dir, f"{job_id}.pdf")
+
+    def _status_path(self, job_id):
+        return os.path.join(self.output_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        """Write a job's status file atomically so other workers never read half of it"""
+        temp_path = f"{self._status_path(job['job_id'])}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(temp_path, self._status_path(job['job_id']))
+
+    def _load(self, job_id):
+        """Read a job's status as recorded by any worker, or None"""
+        try:
+            with open(self._status_path(job_id), encoding='utf-8') as f:
+                job = json.load(f)
+            updated_at = os.path.getmtime(self._status_path(job_id))
+        except (OSError, ValueError):
+            job = None
+        if job is None:
+            # Finished before status files existed - the PDF on disk is still valid
+            if os.path.exists(self.path(job_id)):
+                return {'job_id': job_id, 'status': 'done', 'filename': f"{job_id}.pdf", 'error': None}
+            return None
+
+        if job['status'] == 'done' and not os.path.exists(self.path(job_id)):
+            return None  # Cleaned up
+        if job['status'] in ('queued', 'running') and time.time() - updated_at > self.stale_after:
+            job['status'] = 'failed'
+            job['error'] = 'PDF job was abandoned'
+        return job
+
+    def submit(self, story_data, theme):
+        """Queue a story for rendering and return its job status"""
+        job_id = story_hash(story_data, theme.name)
+        filename = f"{story_data['title'].replace(' ', '_')}.pdf"
+        self._maybe_cleanup(time.time())
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+
+            job = self._load(job_id)
+            if job is not None and job['status'] != 'failed':
+                return job
+            if os.path.exists(self.path(job_id)):
+                job = {'job_id': job_id, 'status': 'done', 'filename': filename, 'error': None}
+                self._save(job)
+                return job
+
+            if len(self._jobs) >= self.max_pending:
+                raise PdfQueueFull(f"Too many PDF jobs are waiting ({self.max_pending}), try again later")
+            job = {'job_id': job_id, 'status': 'queued', 'filename': filename, 'error': None}
+            self._save(job)
+            self._jobs[job_id] = job
+            self._dispatcher.submit(self._run, job, story_data, theme.name)
+            return dict(job)
+
+    def _update(self, job, status, error=None):
+        with self._lock:
+            job['status'] = status
+            job['error'] = error
+            try:
+                self._save(job)
+            except OSError as e:
+                print(f"Error saving PDF job {job['job_id']}: {e}")
+            if status in ('done', 'failed'):
+                self._jobs.pop(job['job_id'], None)
+
+    def _run(self, job, story_data, theme_name):
+        self._update(job, 'running')
+        try:
+            with metrics.span('pdf_images'):
+                images = self.image_loader.load_many(scene.get('image_url') for scene in story_data['scenes'])
+            with metrics.span('pdf_job_build'):
+                future = self._process_pool().submit(
+                    render_pdf_file, story_data, theme_name, images, self.path(job['job_id'])
+                )
+                future.result()
+            self._update(job, 'done')
+        except Exception as e:
+            print(f"Error rendering PDF job {job['job_id']}: {e}")
+            self._update(job, 'failed', str(e))
+
+    def status(self, job_id):
+        """Return the status of a job, or None if it is unknown"""
+        if not is_job_id(job_id):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        return self._load(job_id)
+
+    def _maybe_cleanup(self, now):
+        if now - self._last_cleanup > self.cleanup_interval:
+            self._last_cleanup = now
+            try:
+                self.cleanup()
+            except OSError as e:
+                print(f"Error cleaning up PDF exports: {e}")
+
+    def cleanup(self):
+        """Delete PDFs, status files and leftover temp files older than the TTL; return how many went"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            active = set(self._jobs)
+        removed = 0
+        for name in os.listdir(self.output_dir):
+            if name[:64] in active:
+                continue
+            path = os.path.join(self.output_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass  # Already removed by another worker
+        return removed
@@ -0,0 +1,55 @@
+import io
+
+from reportlab.platypus import Paragraph, Spacer, PageBreak, Image as RLImage
+
+def render_story_pdf(story_data, theme, images):
+    """Lay out a story as a PDF using a theme and a {image_url: PdfImage} dict"""
+    styles = theme.styles
+    buffer = io.BytesIO()
+    doc = theme.doc_template(buffer, title=story_data['title'])
+
+    story = []
+
+    # Add cover page
+    story.append(Paragraph(story_data['title'], styles['title']))
+    story.append(Spacer(1, 40))
+
+    # Add metadata
+    meta_style = styles['meta']
+    if 'genre' in story_data:
+        story.append(Paragraph(f"Genre: {story_data['genre'].title()}", meta_style))
+        story.append(Spacer(1, 10))
+
+    story.append(Paragraph("Generated with AI Storyteller", meta_style))
+    story.append(Spacer(1, 60))
+
+    # Add each scene with improved formatting
+    for scene in story_data['scenes']:
+        # Scene header with number and title
+        scene_header = f"Scene {scene['scene_number']}: {scene['title']}"
+        story.append(Paragraph(scene_header, styles['scene_title']))
+
+        # Scene text with better formatting
+        paragraphs = scene['text'].split('\n\n')
+        for p in paragraphs:
+            if p.strip():
+                story.append(Paragraph(p.strip(), styles['scene_text']))
+
+        # Add image if available
+        image = images.get(scene.get('image_url'))
+        if image:
+            # Add image with proper sizing and spacing
+            aspect = image.height / image.width
+            img_width = theme.image_width  # Fixed width in points
+            img_height = img_width * aspect
+
+            story.append(Spacer(1, 20))
+            story.append(RLImage(io.BytesIO(image.data), width=img_width, height=img_height))
+            story.append(Spacer(1, 20))
+
+        # Add page break between scenes
+        story.append(PageBreak())
+
+    doc.build(story)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,164 @@
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate
+
+_base_styles = getSampleStyleSheet()
+
+def build_styles(title_font='Helvetica-Bold', body_font='Helvetica', title_size=32, scene_title_size=24,
+                 text_size=12, leading=16, title_color='#2C3E50', heading_color='#34495E',
+                 text_color='#2C3E50', meta_color='#7F8C8D'):
+    """Build the four paragraph styles used by the story PDF"""
+    return {
+        'title': ParagraphStyle(
+            'CustomTitle',
+            parent=_base_styles['Heading1'],
+            fontSize=title_size,
+            spaceAfter=30,
+            alignment=1,  # Center
+            textColor=title_color,
+            fontName=title_font
+        ),
+        'scene_title': ParagraphStyle(
+            'SceneTitle',
+            parent=_base_styles['Heading2'],
+            fontSize=scene_title_size,
+            spaceBefore=30,
+            spaceAfter=20,
+            textColor=heading_color,
+            fontName=title_font
+        ),
+        'scene_text': ParagraphStyle(
+            'SceneText',
+            parent=_base_styles['Normal'],
+            fontSize=text_size,
+            leading=leading,
+            spaceBefore=12,
+            spaceAfter=12,
+            textColor=text_color,
+            fontName=body_font
+        ),
+        'meta': ParagraphStyle(
+            'MetaStyle',
+            parent=_base_styles['Normal'],
+            fontSize=14,
+            textColor=meta_color,
+            alignment=1
+        )
+    }
+
+class PdfTheme:
+    """Styles and page layout for one PDF look, built once and shared by all exports.
+
+    Paragraph styles are read-only during layout so they are shared directly.
+    ReportLab frames carry layout state while a document is being built, so
+    only their geometry is precomputed and ``doc_template`` hands every export
+    its own frame.
+    """
+
+    def __init__(self, name, styles, pagesize=letter, margin=72, image_width=400, page_numbers=False,
+                 footer_color='#7F8C8D'):
+        self.name = name
+        self.styles = styles
+        self.pagesize = pagesize
+        self.margin = margin
+        self.image_width = image_width
+        self.page_numbers = page_numbers
+        self.footer_color = footer_color
+        self.frame_rect = (margin, margin, pagesize[0] - 2 * margin, pagesize[1] - 2 * margin)
+
+    def _draw_page(self, canvas, doc):
+        """Draw the page number on every page after the cover"""
+        if not self.page_numbers or doc.page == 1:
+            return
+        canvas.saveState()
+        canvas.setFont('Helvetica', 9)
+        canvas.setFillColor(self.footer_color)
+        canvas.drawCentredString(self.pagesize[0] / 2, self.margin / 2, str(doc.page - 1))
+        canvas.restoreState()
+
+    def doc_template(self, buffer, title=None):
+        """Create a document template writing to buffer using this theme's layout"""
+        doc = BaseDocTemplate(
+            buffer,
+            pagesize=self.pagesize,
+            topMargin=self.margin,
+            bottomMargin=self.margin,
+            leftMargin=self.margin,
+            rightMargin=self.margin,
+            title=title or ''
+        )
+        frame = Frame(*self.frame_rect, id='normal')
+        doc.addPageTemplates([PageTemplate(id='Story', frames=[frame], onPage=self._draw_page, pagesize=self.pagesize)])
+        return doc
+
+# Theme registry, built once at import time
+THEMES = {}
+
+# Which theme to use when the request names an audience or art style but no theme
+AUDIENCE_THEMES = {
+    'children': 'storybook',
+    'kids': 'storybook'
+}
+ART_STYLE_THEMES = {
+    'cartoon': 'storybook',
+    'watercolor': 'storybook',
+    'anime': 'storybook',
+    'noir': 'noir',
+    'dark': 'noir'
+}
+
+DEFAULT_THEME = 'classic'
+
+def register_theme(theme):
+    """Add or replace a theme in the registry"""
+    THEMES[theme.name] = theme
+    return theme
+
+def get_theme(name=None, art_style=None, audience=None):
+    """Pick a theme by explicit name, then audience, then art style, falling back to the default"""
+    for key, table in ((name, THEMES), (audience, AUDIENCE_THEMES), (art_style, ART_STYLE_THEMES)):
+        if not key or not isinstance(key, str):
+            continue  # Request JSON may carry numbers or lists here
+        theme_name = key.lower() if table is THEMES else table.get(key.lower())
+        if theme_name in THEMES:
+            return THEMES[theme_name]
+    return THEMES[DEFAULT_THEME]
+
+register_theme(PdfTheme('classic', build_styles()))
+
+register_theme(PdfTheme(
+    'storybook',
+    build_styles(
+        title_font='Times-Bold',
+        body_font='Times-Roman',
+        title_size=36,
+        scene_title_size=26,
+        text_size=16,
+        leading=22,
+        title_color='#8E44AD',
+        heading_color='#D35400',
+        text_color='#2C3E50',
+        meta_color='#16A085'
+    ),
+    margin=60,
+    image_width=440,
+    page_numbers=True
+))
+
+register_theme(PdfTheme(
+    'noir',
+    build_styles(
+        title_font='Courier-Bold',
+        body_font='Courier',
+        title_size=30,
+        scene_title_size=20,
+        text_size=11,
+        leading=15,
+        title_color='#111111',
+        heading_color='#333333',
+        text_color='#222222',
+        meta_color='#555555'
+    ),
+    page_numbers=True,
+    footer_color='#555555'
+))
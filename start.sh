@@ -0,0 +1,9 @@
+#!/bin/sh
+# Production launcher for Linux: gunicorn with one pre-forked worker per core.
+# Override with WEB_CONCURRENCY, WORKER_THREADS or BIND (see gunicorn.conf.py);
+# extra arguments are passed on to gunicorn.
+set -e
+cd "$(dirname "$0")"
+
+echo "Starting AI Storyteller..."
+exec gunicorn -c gunicorn.conf.py "$@" app:app
@@ -0,0 +1,118 @@
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from collections import namedtuple
+from email.utils import formatdate
+
+from werkzeug.security import safe_join
+
+from image_storage import sharded_name
+
+# Everything needed to answer a request for one file without touching the disk
+StaticAsset = namedtuple('StaticAsset', ['path', 'size', 'mtime', 'etag', 'mimetype', 'immutable', 'stat'])
+
+# <sha256>.jpg originals and <sha256>_<width>w.<ext> derivatives never change once written
+CONTENT_ADDRESSED_PATTERN = re.compile(r'^([0-9a-f]{64})(_\d+w)?\.(jpg|webp|avif)$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Anything else may be replaced in place, so clients revalidate with the ETag
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+
+class StaticAssets:
+    """In-memory metadata for the files served under ``/static``.
+
+    Each file is stat-ed (and, if its name doesn't already carry a content
+    hash, hashed) the first time it is requested; after that every response
+    is built from memory. Content-addressed images get a strong ETag and a
+    year-long immutable Cache-Control, everything else is revalidated.
+    """
+
+    def __init__(self, directory='static'):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._assets = {}  # relative filename -> StaticAsset
+        self._by_hash = {}  # content hash -> set of filenames
+
+    def _build(self, filename):
+        path = safe_join(self.directory, filename)
+        if path is None or os.path.basename(path).startswith('.'):
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        match = CONTENT_ADDRESSED_PATTERN.match(os.path.basename(filename))
+        if match and not match.group(2):
+            # An original's name is the SHA-256 of its bytes, no need to read them
+            etag = match.group(1)
+        else:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    digest.update(chunk)
+            etag = digest.hexdigest()
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return StaticAsset(path, stat.st_size, stat.st_mtime, etag, mimetype, match is not None, stat)
+
+    def lookup(self, filename):
+        """Return the StaticAsset for a filename, or None if it doesn't exist"""
+        # Stories shared before images were sharded still link to /static/<sha256>.jpg
+        filename = sharded_name(filename)
+        with self._lock:
+            asset = self._assets.get(filename)
+        if asset is not None:
+            return asset
+
+        asset = self._build(filename)
+        if asset is None:
+            return None
+        with self._lock:
+            self._assets[filename] = asset
+            match = CONTENT_ADDRESSED_PATTERN.match(os.path.basename(filename))
+            if match:
+                self._by_hash.setdefault(match.group(1), set()).add(filename)
+        return asset
+
+    def forget(self, filename):
+        """Drop cached metadata for a file that was removed or replaced"""
+        filename = sharded_name(filename)
+        with self._lock:
+            asset = self._assets.pop(filename, None)
+            match = CONTENT_ADDRESSED_PATTERN.match(os.path.basename(filename))
+            if asset is not None and match:
+                names = self._by_hash.get(match.group(1))
+                if names:
+                    names.discard(filename)
+                    if not names:
+                        del self._by_hash[match.group(1)]
+
+    def forget_hash(self, content_hash):
+        """Drop metadata for an evicted image and all of its derivatives"""
+        with self._lock:
+            for filename in self._by_hash.pop(content_hash, ()):
+                self._assets.pop(filename, None)
+
+    def headers(self, asset):
+        """Return the caching headers for an asset"""
+        return {
+            'ETag': f'"{asset.etag}"',
+            'Last-Modified': formatdate(asset.mtime, usegmt=True),
+            'Cache-Control': IMMUTABLE_CACHE_CONTROL if asset.immutable else REVALIDATE_CACHE_CONTROL
+        }
+
+    @staticmethod
+    def etag_matches(asset, if_none_match):
+        """True if an If-None-Match header value covers this asset"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        return any(tag.removeprefix('W/') == f'"{asset.etag}"' for tag in tags)
@@ -0,0 +1,92 @@
+import json
+from collections import deque
+
+import metrics
+
+# Defaults for a story request, matching /api/generate-story
+STORY_DEFAULTS = {
+    'genre': 'fantasy',
+    'tone': 'adventurous',
+    'audience': 'general',
+    'art_style': 'realistic'
+}
+
+def parse_story_requests(text):
+    """Yield story request dicts from a JSON array or JSON Lines text.
+
+    A malformed line yields a ValueError in its place, so one bad line fails
+    only its own request.
+    """
+    stripped = text.lstrip()
+    if stripped.startswith('['):
+        yield from json.loads(stripped)
+        return
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON on line {number}: {e}")
+
+def generate_story_batch(generator, story_requests, pool, window=32):
+    """Generate many stories, yielding one result dict per request in input order.
+
+    Each result is {"index": n, "story": {...}} or {"index": n, "error": "..."},
+    plus the request's "id" if it had one. Images are downloaded once per
+    distinct source URL across the whole batch, all through ``pool``, which
+    should be reserved for batches; up to ``window`` stories are kept in
+    flight so the pool stays busy while finished stories are streamed out.
+    """
+    downloads = {}     # source URL -> future resolving to the stored image URL
+    in_flight = deque()  # (result, [(scene, future, source_url), ...])
+
+    def finish(result, scene_futures):
+        for scene, future, source_url in scene_futures:
+            try:
+                image_url = future.result()
+            except Exception as e:
+                print(f"Error fetching batch image {source_url}: {e}")
+                image_url = None
+            generator.attach_image(scene, image_url or source_url)
+        return result
+
+    for index, data in enumerate(story_requests):
+        result = {'index': index}
+        scene_futures = []
+        try:
+            if isinstance(data, Exception):
+                raise data
+            if not isinstance(data, dict):
+                raise ValueError('Story request must be a JSON object')
+            if data.get('id') is not None:
+                result['id'] = data['id']
+
+            idea = str(data.get('idea', '')).strip()
+            if not idea:
+                raise ValueError('Story idea is required')
+            params = {key: data.get(key, default) for key, default in STORY_DEFAULTS.items()}
+
+            story_data = generator.generate_story(idea, **params)
+            scenes = story_data['scenes']
+            with metrics.span('image_selection'):
+                source_urls = generator.image_selector.select_story_images(
+                    [scene['image_prompt'] for scene in scenes], params['genre']
+                )
+            for scene, source_url in zip(scenes, source_urls):
+                future = downloads.get(source_url)
+                if future is None:
+                    future = pool.submit(generator.generate_scene_image, scene, params['art_style'], source_url)
+                    downloads[source_url] = future
+                scene_futures.append((scene, future, source_url))
+            result['story'] = story_data
+        except Exception as e:
+            result['error'] = str(e)
+
+        in_flight.append((result, scene_futures))
+        while len(in_flight) > window:
+            yield finish(*in_flight.popleft())
+
+    while in_flight:
+        yield finish(*in_flight.popleft())
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+def story_request_key(idea, genre, tone, audience, art_style):
+    """Build a cache key from generation parameters.
+
+    Only surrounding whitespace is ignored; case and inner spacing end up in
+    the story text, so requests differing in them get their own entries.
+    """
+    return tuple(str(value).strip() for value in (idea, genre, tone, audience, art_style))
+
+class _Flight:
+    """One in-progress computation that concurrent callers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class StoryResponseCache:
+    """TTL + LRU cache of generated story responses with single-flight coalescing.
+
+    Values should be immutable (the app caches the serialized JSON body), so
+    hits can be returned without copying. While a key is being computed,
+    identical requests wait for that computation instead of starting their
+    own; failures are passed to the waiters but never cached. Entries expire
+    after ``ttl`` seconds, which also bounds how long a story can point at an
+    image the image cache has since evicted. ``ttl_for(value)`` can give a
+    single value a shorter lifetime: seconds, 0 to skip caching it, or None
+    for the default.
+    """
+
+    def __init__(self, ttl=300, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._flights = {}             # key -> _Flight
+        self._async_flights = {}       # key -> asyncio.Future
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _lookup(self, key):
+        # Caller holds the lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, value, ttl_for=None):
+        ttl = ttl_for(value) if ttl_for else None
+        if ttl is None:
+            ttl = self.ttl
+        elif ttl <= 0:
+            return
+        if not self.max_entries:
+            return
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute, ttl_for=None):
+        """Return the cached value for key, computing it at most once across threads"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+            self._store(key, flight.result, ttl_for)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def get_or_compute_async(self, key, compute, ttl_for=None):
+        """Asyncio version of get_or_compute; compute is a coroutine function"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            future = self._async_flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._async_flights[key] = asyncio.get_running_loop().create_future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            # Shield so a cancelled waiter doesn't cancel the shared result
+            return await asyncio.shield(future)
+
+        try:
+            value = await compute()
+            self._store(key, value, ttl_for)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure isn't logged as lost
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            with self._lock:
+                del self._async_flights[key]
+
+    def stats(self):
+        """Return cache counters and usage"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl
+            }
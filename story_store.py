@@ -0,0 +1,315 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+def thread_connection(local, path):
+    """Return this thread's SQLite connection to path, kept on the threading.local()"""
+    # Connections must not be shared across a fork, so they are keyed by pid too
+    conn = getattr(local, 'conn', None)
+    if conn is None or local.pid != os.getpid():
+        conn = sqlite3.connect(path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        local.conn = conn
+        local.pid = os.getpid()
+    return conn
+
+def canonical_json(story_data):
+    """Serialize a story the same way regardless of key order or whitespace"""
+    return json.dumps(story_data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def story_content_hash(story_data):
+    return hashlib.sha256(canonical_json(story_data).encode('utf-8')).hexdigest()
+
+def compress_story(story_data):
+    return zlib.compress(canonical_json(story_data).encode('utf-8'), 6)
+
+def decompress_story(payload):
+    # Rows written before payloads were compressed hold plain JSON text
+    if isinstance(payload, str):
+        return json.loads(payload)
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+class StoryStore:
+    """Interface for shared-story storage backends"""
+
+    def get(self, story_id):
+        """Return the story dict for an id, or None if missing or expired"""
+        raise NotImplementedError
+
+    def put(self, story_id, story_data):
+        """Store a story under an id and return its expiry timestamp (or None)"""
+        raise NotImplementedError
+
+    def share(self, story_data):
+        """Store a story once per distinct content and return its id.
+
+        Sharing an identical story again returns the existing id and refreshes
+        its expiry instead of storing another copy.
+        """
+        raise NotImplementedError
+
+    def purge_expired(self):
+        """Remove expired stories and return how many were dropped"""
+        return 0
+
+    def iter_stories(self):
+        """Yield (story_id, story_data, expires_at) for every unexpired story"""
+        return iter(())
+
+class MemoryStoryStore(StoryStore):
+    """Process-local store with TTL expiry and an optional size bound (LRU).
+
+    With ``compress`` set, stories are kept zlib-compressed and indexed by
+    content hash; the uncompressed mode is used as a front cache.
+    """
+
+    def __init__(self, ttl=None, max_entries=None, compress=True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._stories = OrderedDict()  # story_id -> (expires_at, content_hash, payload)
+        self._hashes = {}              # content_hash -> story_id
+
+    def get(self, story_id):
+        with self._lock:
+            entry = self._stories.get(story_id)
+            if entry is None:
+                return None
+            expires_at, _, payload = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(story_id)
+                return None
+            self._stories.move_to_end(story_id)
+        return decompress_story(payload) if self.compress else payload
+
+    def _remove(self, story_id):
+        _, content_hash, _ = self._stories.pop(story_id)
+        if content_hash is not None and self._hashes.get(content_hash) == story_id:
+            del self._hashes[content_hash]
+
+    def put(self, story_id, story_data, expires_at=None, content_hash=None):
+        if expires_at is None and self.ttl:
+            expires_at = time.time() + self.ttl
+        if self.compress:
+            content_hash = content_hash or story_content_hash(story_data)
+            payload = compress_story(story_data)
+        else:
+            payload = story_data
+        with self._lock:
+            if story_id in self._stories:
+                self._remove(story_id)
+            self._stories[story_id] = (expires_at, content_hash, payload)
+            if content_hash is not None:
+                self._hashes[content_hash] = story_id
+            if self.max_entries:
+                while len(self._stories) > self.max_entries:
+                    self._remove(next(iter(self._stories)))
+        return expires_at
+
+    def share(self, story_data):
+        content_hash = story_content_hash(story_data)
+        with self._lock:
+            story_id = self._hashes.get(content_hash)
+        if story_id is None or self.get(story_id) is None:
+            story_id = str(uuid.uuid4())
+        self.put(story_id, story_data, content_hash=content_hash)
+        return story_id
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [k for k, (expires_at, _, _) in self._stories.items() if expires_at is not None and expires_at <= now]
+            for story_id in expired:
+                self._remove(story_id)
+        return len(expired)
+
+    def iter_stories(self):
+        now = time.time()
+        with self._lock:
+            entries = list(self._stories.items())
+        for story_id, (expires_at, _, payload) in entries:
+            if expires_at is None or expires_at > now:
+                yield story_id, decompress_story(payload) if self.compress else payload, expires_at
+
+class SQLiteStoryStore(StoryStore):
+    """Persistent store shared by every worker process on the host.
+
+    Uses WAL mode so readers in other processes aren't blocked by writers,
+    one connection per thread, and indexes on story_id (primary key),
+    content_hash and created_at. Payloads are stored zlib-compressed. Expired
+    rows are ignored on read and purged periodically.
+    """
+
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS shared_stories (
+            story_id TEXT PRIMARY KEY,
+            payload BLOB NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL,
+            content_hash TEXT
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_shared_stories_created_at ON shared_stories (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_shared_stories_expires_at ON shared_stories (expires_at)'
+    ]
+
+    def __init__(self, path='shared_stories.db', ttl=None, purge_interval=300):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._last_purge = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        conn = self._connection()
+        with conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            # Databases created before content hashing lack the column
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(shared_stories)')]
+            if 'content_hash' not in columns:
+                conn.execute('ALTER TABLE shared_stories ADD COLUMN content_hash TEXT')
+            conn.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS idx_shared_stories_content_hash ON shared_stories (content_hash)'
+            )
+
+    def _connection(self):
+        return thread_connection(self._local, self.path)
+
+    def get(self, story_id):
+        return self.get_with_expiry(story_id)[0]
+
+    def get_with_expiry(self, story_id):
+        """Return (story_data, expires_at), or (None, None) if missing or expired"""
+        row = self._connection().execute(
+            'SELECT payload, expires_at FROM shared_stories WHERE story_id = ?', (story_id,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None, None
+        return decompress_story(row[0]), row[1]
+
+    def _maybe_purge(self, now):
+        if now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            self.purge_expired()
+
+    def put(self, story_id, story_data, expires_at=None):
+        now = time.time()
+        if expires_at is None and self.ttl:
+            expires_at = now + self.ttl
+        conn = self._connection()
+        with conn:
+            # A story stored under a new id takes over its content hash
+            content_hash = story_content_hash(story_data)
+            conn.execute('DELETE FROM shared_stories WHERE content_hash = ? AND story_id != ?', (content_hash, story_id))
+            conn.execute(
+                'INSERT OR REPLACE INTO shared_stories (story_id, payload, created_at, expires_at, content_hash) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (story_id, compress_story(story_data), now, expires_at, content_hash)
+            )
+
+        self._maybe_purge(now)
+        return expires_at
+
+    def share_with_expiry(self, story_data):
+        """Like share(), but also return the story's new expiry timestamp"""
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        content_hash = story_content_hash(story_data)
+        conn = self._connection()
+        with conn:
+            # One write transaction, so concurrent workers sharing the same story agree on
+            # a single row; an existing row (even an expired one) keeps its id and is extended,
+            # never replaced, since its id may already have been handed out
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT INTO shared_stories (story_id, payload, created_at, expires_at, content_hash) '
+                'VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(content_hash) DO UPDATE SET expires_at = excluded.expires_at',
+                (str(uuid.uuid4()), compress_story(story_data), now, expires_at, content_hash)
+            )
+            story_id = conn.execute(
+                'SELECT story_id FROM shared_stories WHERE content_hash = ?', (content_hash,)
+            ).fetchone()[0]
+
+        self._maybe_purge(now)
+        return story_id, expires_at
+
+    def share(self, story_data):
+        return self.share_with_expiry(story_data)[0]
+
+    def purge_expired(self):
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                'DELETE FROM shared_stories WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),)
+            )
+        return cursor.rowcount
+
+    def iter_stories(self):
+        rows = self._connection().execute(
+            'SELECT story_id, payload, expires_at FROM shared_stories WHERE expires_at IS NULL OR expires_at > ?',
+            (time.time(),)
+        )
+        for story_id, payload, expires_at in rows:
+            yield story_id, decompress_story(payload), expires_at
+
+class CachedStoryStore(StoryStore):
+    """Bounded in-memory LRU in front of a persistent backend.
+
+    Shared stories never change once written, so entries cached by one
+    worker stay valid until they expire.
+    """
+
+    def __init__(self, backend, max_entries=1024):
+        self.backend = backend
+        self.cache = MemoryStoryStore(max_entries=max_entries, compress=False)
+
+    def get(self, story_id):
+        story_data = self.cache.get(story_id)
+        if story_data is not None:
+            return story_data
+
+        story_data, expires_at = self.backend.get_with_expiry(story_id)
+        if story_data is not None:
+            self.cache.put(story_id, story_data, expires_at)
+        return story_data
+
+    def put(self, story_id, story_data):
+        expires_at = self.backend.put(story_id, story_data)
+        self.cache.put(story_id, story_data, expires_at)
+        return expires_at
+
+    def share(self, story_data):
+        story_id, expires_at = self.backend.share_with_expiry(story_data)
+        self.cache.put(story_id, story_data, expires_at)
+        return story_id
+
+    def purge_expired(self):
+        self.cache.purge_expired()
+        return self.backend.purge_expired()
+
+    def iter_stories(self):
+        return self.backend.iter_stories()
+
+def create_story_store(backend='sqlite', path='shared_stories.db', ttl=None, cache_size=1024):
+    """Build the configured story store"""
+    if backend == 'memory':
+        return MemoryStoryStore(ttl=ttl)
+    if backend != 'sqlite':
+        raise ValueError(f"Unknown story store backend: {backend}")
+
+    store = SQLiteStoryStore(path, ttl=ttl)
+    if cache_size:
+        return CachedStoryStore(store, max_entries=cache_size)
+    return store
@@ -0,0 +1,159 @@
+import json
+import os
+import string
+from operator import itemgetter
+
+# Values a template may refer to, e.g. "The Tale of {idea}"
+TEMPLATE_FIELDS = ('idea', 'genre', 'tone', 'audience', 'art_style', 'scene_number')
+
+DEFAULT_TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'story_templates.json')
+
+# Values passed to every render function, in this order
+RENDER_ARGS = ('idea', 'genre', 'tone', 'audience', 'art_style')
+
+def parse_template(text):
+    """Split a "{field}" template into (literal, field) parts, field None after the last literal"""
+    parts = []
+    for literal, field, spec, conversion in string.Formatter().parse(text):
+        if field is not None and (field not in TEMPLATE_FIELDS or spec or conversion):
+            raise ValueError(f"Unsupported template field {{{field}}} in {text!r}")
+        parts.append((literal, field))
+    return parts
+
+def compile_template(templates, constants=None, scene_number=0):
+    """Compile a dict of "{field}" template strings into one render function.
+
+    The result takes RENDER_ARGS positionally and returns a new dict with every
+    template filled in, plus ``constants`` copied as-is. Each template is
+    parsed and validated once; only the names in TEMPLATE_FIELDS are allowed,
+    without conversions or format specs. Each template's pieces are then
+    indexes into the render arguments followed by the literal text, so
+    filling one in is an itemgetter call and a join.
+    """
+    # The scene number follows RENDER_ARGS, matching its index in TEMPLATE_FIELDS
+    literals = [str(scene_number), '']
+    empty = len(RENDER_ARGS) + 1
+    picks = []
+    for key, text in templates.items():
+        # Starting with the empty string keeps itemgetter returning a tuple
+        order = [empty]
+        for literal, field in parse_template(text):
+            if literal:
+                order.append(len(RENDER_ARGS) + len(literals))
+                literals.append(literal)
+            if field is not None:
+                order.append(TEMPLATE_FIELDS.index(field))
+        if len(order) == 1:
+            order.append(empty)
+        picks.append((key, itemgetter(*order)))
+    literals = tuple(literals)
+    picks = tuple(picks)
+    constants = tuple((constants or {}).items())
+
+    def render(idea, genre, tone, audience, art_style):
+        values = (str(idea), str(genre), str(tone), str(audience), str(art_style)) + literals
+        result = dict(constants)
+        for key, pick in picks:
+            result[key] = ''.join(pick(values))
+        return result
+
+    return render
+
+class StoryTemplate:
+    """A compiled story outline: title, theme and an ordered list of scenes"""
+
+    def __init__(self, name, title, theme, scenes):
+        self.name = name
+        self._header = compile_template({'title': title, 'theme': theme})
+        self._scenes = tuple(
+            compile_template(
+                {'title': scene['title'], 'text': scene['text'], 'image_prompt': scene['image_prompt']},
+                constants={'scene_number': number},
+                scene_number=number
+            )
+            for number, scene in enumerate(scenes, 1)
+        )
+        if not self._scenes:
+            raise ValueError(f"Story template {name!r} has no scenes")
+
+    @property
+    def scene_count(self):
+        return len(self._scenes)
+
+    def header(self, idea, genre, tone, audience, art_style):
+        """Return the story dict without its scenes"""
+        header = self._header(idea, genre, tone, audience, art_style)
+        return {'title': header['title'], 'genre': genre, 'theme': header['theme']}
+
+    def iter_scenes(self, idea, genre, tone, audience, art_style):
+        """Yield the story's scenes one at a time"""
+        for render in self._scenes:
+            yield render(idea, genre, tone, audience, art_style)
+
+class StoryTemplateEngine:
+    """Picks and renders story templates loaded from a JSON data file.
+
+    The file holds named templates, a default, and an ordered list of
+    selection rules matching genre, tone and/or audience; see
+    data/story_templates.json. Everything is compiled at startup.
+    """
+
+    SELECT_FIELDS = ('genre', 'tone', 'audience')
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.environ.get('STORY_TEMPLATES_PATH', DEFAULT_TEMPLATES_PATH)
+        self.load(path)
+
+    def load(self, path):
+        """(Re)load and compile the templates in a JSON file"""
+        with open(path, encoding='utf-8') as f:
+            table = json.load(f)
+
+        templates = {
+            name: StoryTemplate(name, spec['title'], spec['theme'], spec['scenes'])
+            for name, spec in table['templates'].items()
+        }
+        rules = []
+        for rule in table.get('select', []):
+            if rule['template'] not in templates:
+                raise ValueError(f"Selection rule refers to unknown story template {rule['template']!r}")
+            conditions = tuple((field, rule[field].lower()) for field in self.SELECT_FIELDS if field in rule)
+            rules.append((conditions, templates[rule['template']]))
+
+        default = table.get('default', 'classic')
+        if default not in templates:
+            raise ValueError(f"Unknown default story template {default!r}")
+
+        # Swap everything in at once so concurrent renders see a consistent set
+        self.templates, self.rules, self.default = templates, tuple(rules), templates[default]
+        self._selected = {}
+
+    def select(self, genre=None, tone=None, audience=None):
+        """Return the first template whose rule matches, else the default"""
+        key = (genre, tone, audience)
+        template = self._selected.get(key)
+        if template is None:
+            template = self._match(genre, tone, audience)
+            if len(self._selected) >= 4096:
+                self._selected.clear()
+            self._selected[key] = template
+        return template
+
+    def _match(self, genre, tone, audience):
+        values = {'genre': (genre or '').lower(), 'tone': (tone or '').lower(), 'audience': (audience or '').lower()}
+        for conditions, template in self.rules:
+            if all(values[field] == expected for field, expected in conditions):
+                return template
+        return self.default
+
+    def get(self, name):
+        return self.templates[name]
+
+    def render(self, idea, genre="fantasy", tone="adventurous", audience="general", art_style="realistic",
+               template=None):
+        """Render a complete story dict, picking a template if none is named"""
+        template = self.get(template) if template else self.select(genre, tone, audience)
+        story = template.header(idea, genre, tone, audience, art_style)
+        story['scenes'] = list(template.iter_scenes(idea, genre, tone, audience, art_style))
+        return story
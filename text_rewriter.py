@@ -0,0 +1,85 @@
+import json
+import os
+import re
+
+DEFAULT_REWRITES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'text_rewrites.json')
+
+def trie_pattern(words):
+    """Build a regex alternation for words shaped like a trie.
+
+    Shared prefixes are factored out ("door|doorway" becomes "door(?:way)?"),
+    so each position in the text is checked character by character instead
+    of once per word, and matching cost doesn't grow with the rule count.
+    Longer words win over their prefixes.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if '' in node:
+            return '(?:' + '|'.join(branches) + ')?'
+        if len(branches) == 1:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')'
+
+    return build(trie)
+
+class TextRewriter:
+    """Rule-based scene text enhancement in a single regex pass.
+
+    Every substitution and the sentence breaks are compiled into one
+    pattern, so the text is scanned once regardless of how many rules there
+    are. Words match case-sensitively, like the str.replace chain this
+    replaced, and only as whole words or their plurals: "robots" is
+    rewritten, "robotics" and "doorway" are not.
+    """
+
+    def __init__(self, rules, sentence_end='.!', sentence_break='\n', min_words=11):
+        self.rules = {word: replacement for word, replacement in rules.items() if word}
+        self.sentence_break = sentence_break
+        self.min_words = min_words
+
+        parts = []
+        if self.rules:
+            # A plural suffix is left in place after the replacement
+            parts.append(r'(?P<word>\b' + trie_pattern(self.rules) + r')(?=(?:s|es)?\b)')
+        if sentence_end:
+            parts.append('(?P<end>[' + re.escape(sentence_end) + '])')
+        self.pattern = re.compile('|'.join(parts)) if parts else None
+
+    @classmethod
+    def from_file(cls, path=None):
+        """Load rules from a JSON file (see data/text_rewrites.json)"""
+        if path is None:
+            path = os.environ.get('TEXT_REWRITES_PATH', DEFAULT_REWRITES_PATH)
+        with open(path, encoding='utf-8') as f:
+            table = json.load(f)
+        return cls(
+            table.get('rules', {}),
+            sentence_end=table.get('sentence_end', '.!'),
+            sentence_break=table.get('sentence_break', '\n'),
+            min_words=table.get('min_words', 11)
+        )
+
+    def _replace(self, match):
+        word = match.group('word') if self.rules else None
+        if word is None:
+            return match.group() + self.sentence_break
+        return self.rules[word]
+
+    def rewrite(self, text):
+        """Return the enhanced text; short texts are returned unchanged"""
+        if self.pattern is None or len(text.split()) < self.min_words:
+            return text
+        return self.pattern.sub(self._replace, text)
+
+    def rewrite_many(self, texts):
+        """Rewrite a batch of scene texts"""
+        return [self.rewrite(text) for text in texts]